@@ -0,0 +1,75 @@
+import asyncio
+import json
+import logging
+import time
+from functools import cache
+from typing import AsyncIterator
+
+import redis
+import redis.asyncio
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .models import Job
+from .renderers import sse_event
+
+logger = logging.getLogger(settings.APP_NAME)
+
+# Statuses after which a job never changes again
+FINAL_STATUSES = ("completed", "failed", "aborted")
+
+
+def job_state(job_id: str) -> dict | None:
+    return Job.objects.filter(id=job_id).values("id", "status", "pages_done", "pages_total").first()
+
+
+def job_channel(job_id: str) -> str:
+    return f"ocr:job:{job_id}"
+
+
+@cache
+def publisher() -> redis.Redis:
+    return redis.Redis.from_url(settings.OCR_EVENTS_REDIS_URL, socket_connect_timeout=1)
+
+
+# Monotonic time to publish again at after Redis was unreachable
+publish_retry_at = 0.0
+
+
+def notify_job(job_id: str):
+    """
+    Publish the current state of a job to anyone waiting on it. Jobs run in Celery workers and are
+    watched from web processes, so states go through Redis pub/sub. After a failure nothing is published
+    for OCR_EVENTS_RETRY_AFTER seconds, so job updates don't each wait out a connect timeout.
+    """
+    global publish_retry_at
+    if time.monotonic() < publish_retry_at or (state := job_state(job_id)) is None:
+        return
+    try:
+        publisher().publish(job_channel(job_id), json.dumps(state))
+    except redis.RedisError as e:
+        publish_retry_at = time.monotonic() + settings.OCR_EVENTS_RETRY_AFTER
+        logger.warning(f"Could not publish state of {job_id=}: {e}")
+
+
+async def job_events(job_id: str, state: dict) -> AsyncIterator[str]:
+    """
+    Server-sent events for a job: its current `state`, then every change until it finishes, with
+    keep-alive comments in between. The stream ends after OCR_EVENTS_TIMEOUT seconds, and EventSource
+    clients reconnect on their own.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.OCR_EVENTS_TIMEOUT
+    client = redis.asyncio.Redis.from_url(settings.OCR_EVENTS_REDIS_URL)
+    async with client, client.pubsub() as pubsub:
+        await pubsub.subscribe(job_channel(job_id))
+        # Changes made before subscribing are covered by re-reading the state
+        state = await sync_to_async(job_state)(job_id) or state
+        yield sse_event("state", state)
+        while state["status"] not in FINAL_STATUSES and loop.time() < deadline:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=settings.OCR_EVENTS_HEARTBEAT)
+            if message is None:
+                yield ": keep-alive\n\n"
+                continue
+            state = json.loads(message["data"])
+            yield sse_event("state", state)
@@ -1,57 +1,377 @@
 import logging
+import math
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from contextlib import closing
+from itertools import batched, chain
 from pathlib import Path
+from typing import Callable, Iterable, Iterator
 
 import numpy as np
+import onnxruntime as ort
 import pymupdf
+from attrs import define, field
 from django.conf import settings
 from paddleocr import PaddleOCR
-from PIL import Image
+from paddleocr.tools.infer.predict_system import sorted_boxes
+from paddleocr.tools.infer.utility import get_rotate_crop_image
+from PIL import Image, ImageDraw
 
-from .utils import Document, Page, read_file
+from .cache import page_cache
+from .utils import Document, Page, model_path, read_file
 
 ppocr_logger = logging.getLogger("ppocr")
 ppocr_logger.setLevel(logging.INFO)
 
 logger = logging.getLogger(settings.APP_NAME)
 
+# Boxes are reported in the 2x page space the API has always used, whatever zoom a page was rendered at
+OUTPUT_ZOOM = 2
+
+_DONE = object()
+
+
+class OcrAborted(Exception):
+    """Raised by OcrEngine when its `should_abort` callback asks it to stop."""
+
+
+def check_abort(should_abort: Callable[[], bool] | None):
+    if should_abort is not None and should_abort():
+        raise OcrAborted
+
+
+def prefetch(items: Iterable, fn: Callable, depth: int) -> Iterator:
+    """
+    Yield `fn(item)` for each item, computed on a background thread that runs at
+    most `depth` results ahead of the consumer.
+
+    A single producer thread is used on purpose: MuPDF objects must not be used
+    from several threads at once, but one thread rendering while the caller runs
+    inference is safe and is where the overlap comes from.
+    """
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if stop.is_set() or not put(fn(item)):
+                    return
+        except BaseException as e:
+            put(e)
+        else:
+            put(_DONE)
+
+    producer = threading.Thread(target=produce, name="ocr-prefetch", daemon=True)
+    producer.start()
+    try:
+        while (result := buffer.get()) is not _DONE:
+            if isinstance(result, BaseException):
+                raise result
+            yield result
+    finally:
+        stop.set()
+        producer.join()
+
+
+@define
+class RenderedPage:
+    """A rendered page whose pixels are viewed in place as an (h, w, 3) array."""
+
+    pixmap: pymupdf.Pixmap = field(repr=False)
+    zoom: float
+    cache_key: str | None = field(default=None, repr=False)
+    array: np.ndarray = field(init=False, repr=False)
+
+    def __attrs_post_init__(self):
+        # samples_mv does not keep the pixmap alive, so the pixmap is held here for as long as the array view is in use
+        pm = self.pixmap
+        self.array = np.frombuffer(pm.samples_mv, dtype=np.uint8).reshape(pm.height, pm.width, pm.n)
+
+    @property
+    def image(self) -> Image.Image:
+        return Image.fromarray(self.array)
+
+
+def scale_boxes(result: list, factor: float) -> list:
+    """Scale the boxes of a `[box, (text, score)]` result by `factor`."""
+    if factor == 1:
+        return result
+    return [[[[x * factor, y * factor] for x, y in box], rec] for box, rec in result]
+
+
+def scanned_images(page: pymupdf.Page) -> list[dict]:
+    """Info of the images covering at least half of a page, as a scan's do."""
+    half_page = page.rect.get_area() / 2
+    return [info for info in page.get_image_info() if pymupdf.Rect(info["bbox"]).get_area() >= half_page]
+
+
+def read_text_layer(page: pymupdf.Page, min_chars: int, min_coverage: float) -> list | None:
+    """
+    Lines of a page's own text layer as a `[box, (text, score)]` result in output
+    space, or None when the page has no usable text layer and needs OCR.
+    """
+    lines, rects = [], []
+    for block in page.get_text("dict", flags=pymupdf.TEXTFLAGS_TEXT)["blocks"]:
+        for line in block.get("lines", []):
+            text = "".join(span["text"] for span in line["spans"]).strip()
+            if not text:
+                continue
+            rects.append(pymupdf.Rect(line["bbox"]))
+            # Text coordinates ignore page rotation while renders include it
+            rect = rects[-1] * page.rotation_matrix * OUTPUT_ZOOM
+            box = [[rect.x0, rect.y0], [rect.x1, rect.y0], [rect.x1, rect.y1], [rect.x0, rect.y1]]
+            lines.append([box, (text, 1.0)])
+
+    # Scans without a text layer have nothing to extract, and broken font encodings come out as replacement characters;
+    # both are left to OCR
+    chars = "".join(rec[0] for _, rec in lines)
+    if len(chars) < min_chars or chars.count("\ufffd") > len(chars) / 10:
+        return None
+
+    # A scan whose text layer is only a stamp, Bates number or header has most of its image bare of text, and its body
+    # is left to OCR
+    for info in scanned_images(page):
+        image = pymupdf.Rect(info["bbox"])
+        covered = sum((rect & image).get_area() for rect in rects)
+        if covered < image.get_area() * min_coverage:
+            return None
+    return lines
+
+
+def session_options() -> ort.SessionOptions:
+    """ONNX Runtime session options from the OCR_ORT_* settings."""
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = settings.OCR_ORT_INTRA_OP_THREADS
+    options.inter_op_num_threads = settings.OCR_ORT_INTER_OP_THREADS
+    options.execution_mode = getattr(ort.ExecutionMode, settings.OCR_ORT_EXECUTION_MODE)
+    options.graph_optimization_level = getattr(ort.GraphOptimizationLevel, settings.OCR_ORT_GRAPH_OPTIMIZATION)
+    # Idle threads spin waiting for work by default, taking cores other workers need
+    spinning = "1" if settings.OCR_ORT_ALLOW_SPINNING else "0"
+    options.add_session_config_entry("session.intra_op.allow_spinning", spinning)
+    return options
+
+
+def pin_worker(slot: int):
+    """
+    With OCR_PIN_WORKERS, pin the `slot`th worker process to its own
+    OCR_ORT_INTRA_OP_THREADS cores, wrapping around when more workers than fit. Call it
+    before loading an OcrEngine, whose threads inherit the pinning.
+    """
+    cores_per_worker = settings.OCR_ORT_INTRA_OP_THREADS
+    if not settings.OCR_PIN_WORKERS or not cores_per_worker:
+        return
+
+    cores = sorted(os.sched_getaffinity(0))
+    start = slot % max(len(cores) // cores_per_worker, 1) * cores_per_worker
+    worker_cores = cores[start : start + cores_per_worker]
+    os.sched_setaffinity(0, worker_cores)
+    logger.info(f"Pinned worker {slot} to cores {worker_cores}")
+
 
 class OcrEngine:
     def __init__(self):
         logger.info("Initializing OCR engine")
         self.model = PaddleOCR(
-            cls_model_dir=(settings.PADDLE_MODELS_DIR / "ch_ppocr_mobile_v2.0_cls_infer.onnx").as_posix(),
-            det_model_dir=(settings.PADDLE_MODELS_DIR / "Multilingual_PP-OCRv3_det_infer.onnx").as_posix(),
-            rec_model_dir=(settings.PADDLE_MODELS_DIR / "latin_PP-OCRv3_rec_infer.onnx").as_posix(),
+            cls_model_dir=model_path("cls").as_posix(),
+            det_model_dir=model_path("det").as_posix(),
+            rec_model_dir=model_path("rec").as_posix(),
+            rec_batch_num=settings.OCR_REC_BATCH_SIZE,
             use_angle_cls=False,
             use_gpu=False,
             use_onnx=True,
             lang="fr",
         )
+        # PaddleOCR builds its sessions with default options, a thread per core for each, so they are rebuilt with ours
+        options = session_options()
+        predictors = {"det": self.model.text_detector, "rec": self.model.text_recognizer}
+        for name, predictor in predictors.items():
+            predictor.predictor = ort.InferenceSession(
+                model_path(name).as_posix(), options, providers=["CPUExecutionProvider"]
+            )
+            predictor.input_tensor = predictor.predictor.get_inputs()[0]
+        # Resolution policy: render at render_dpi, but never beyond the native resolution of a scanned page and never
+        # over render_max_pixels
+        self.render_dpi = settings.OCR_RENDER_DPI
+        self.render_min_dpi = settings.OCR_RENDER_MIN_DPI
+        self.render_max_pixels = settings.OCR_RENDER_MAX_PIXELS
+        # Born-digital pages are read from their text layer instead of being OCRed
+        self.use_text_layer = settings.OCR_USE_TEXT_LAYER
+        self.text_layer_min_chars = settings.OCR_TEXT_LAYER_MIN_CHARS
+        self.text_layer_min_coverage = settings.OCR_TEXT_LAYER_MIN_COVERAGE
+        # Pages seen before are answered from the page cache
+        self.use_page_cache = settings.OCR_USE_PAGE_CACHE
+
+    def warm_up(self):
+        """
+        Run detection and recognition once on a synthetic line of text, so the one-off
+        costs of a first inference (allocating memory arenas, picking kernels) are
+        paid before the first job.
+        """
+        start = time.perf_counter()
+        image = Image.new("RGB", (640, 96), "white")
+        ImageDraw.Draw(image).text((16, 24), "Warm-up 0123456789", fill="black", font_size=40)
+        pixels = np.asarray(image)
+        self.model.text_detector(pixels)
+        self.model.text_recognizer([pixels])
+        logger.info(f"OCR engine warmed up in {time.perf_counter() - start:.2f}s")
 
-    def ocr_document(self, file_path: str) -> Document:
+    def ocr_document(
+        self,
+        file_path: str,
+        stats: Counter | None = None,
+        should_abort: Callable[[], bool] | None = None,
+        on_pages: Callable[[list[Page]], None] | None = None,
+    ) -> Document:
         logger.info(f"OCR document at {file_path=}")
         document = read_file(file_path)
-        pages = []
-        for page in document:
-            result = self.ocr_page(page)
-            pages.append(Page(page.number, result[0]))
+        pages = self.ocr_pages(document, stats=stats, should_abort=should_abort, on_pages=on_pages)
         return Document(file_path, pages)
 
-    def ocr_document_multi(self, file_path: str) -> Document:
+    def ocr_document_multi(
+        self,
+        file_path: str,
+        stats: Counter | None = None,
+        should_abort: Callable[[], bool] | None = None,
+        on_pages: Callable[[list[Page]], None] | None = None,
+        files: Iterable[str] | None = None,
+    ) -> Document:
+        """
+        OCR the files in the directory at `file_path` as one document, or only `files` in that order when given, for
+        directories shared with other jobs' files.
+        """
         logger.info(f"OCR multiple files in single document at {file_path=}")
-        page_no = 0
-        pages = []
-        for f in Path(file_path).glob("*"):
-            document = read_file(f.as_posix())
-            for page in document:
-                result = self.ocr_page(page)
-                pages.append(Page(page_no, result[0]))
-                page_no += 1
+        files = (f.as_posix() for f in Path(file_path).glob("*")) if files is None else files
+        documents = [read_file(f) for f in files]
+        pages = self.ocr_pages(
+            chain.from_iterable(documents), stats=stats, should_abort=should_abort, on_pages=on_pages
+        )
         return Document(file_path, pages)
 
-    def ocr_page(self, page: pymupdf.Page) -> list:
-        mat = pymupdf.Matrix(2, 2)
-        pm = page.get_pixmap(matrix=mat, alpha=False)
-        img = Image.frombytes("RGB", [pm.width, pm.height], pm.samples)
+    def ocr_pages(
+        self,
+        pages: Iterable[pymupdf.Page],
+        batch_size: int | None = None,
+        start: int = 0,
+        stats: Counter | None = None,
+        should_abort: Callable[[], bool] | None = None,
+        on_pages: Callable[[list[Page]], None] | None = None,
+    ) -> list[Page]:
+        """
+        OCR pages in batches, numbering them from `start` in iteration order. `stats`, if
+        given, counts how pages were read: from their text layer, the page cache, or OCR.
+        `should_abort` is polled between pages, and OcrAborted is raised as soon as it
+        returns True. `on_pages` is called with each batch of pages as soon as it is done.
+        """
+        batch_size = batch_size or settings.OCR_BATCH_SIZE
+        stats = stats if stats is not None else Counter()
+        # Prepare upcoming pages on a background thread while earlier ones are inferred
+        prepared = prefetch(pages, self.prepare_page, settings.OCR_PREFETCH_DEPTH)
+        pages = []
+        # Stopping early, on abort or an error, stops the render thread before the caller closes the document it renders
+        # from
+        with closing(prepared):
+            for batch in batched(prepared, batch_size):
+                check_abort(should_abort)
+                rendered = [item for source, item in batch if source == "ocr"]
+                ocr_results = iter(self.ocr_images([r.array for r in rendered], should_abort))
+                results = []
+                for source, item in batch:
+                    stats[source] += 1
+                    if source != "ocr":
+                        results.append(item)
+                        continue
+
+                    result = scale_boxes(next(ocr_results), OUTPUT_ZOOM / item.zoom)
+                    if item.cache_key:
+                        page_cache.set(item.cache_key, result)
+                    results.append(result)
+
+                first = start + len(pages)
+                batch_pages = [Page(n, result) for n, result in enumerate(results, first)]
+                pages.extend(batch_pages)
+                if on_pages is not None:
+                    on_pages(batch_pages)
+        return pages
+
+    def prepare_page(self, page: pymupdf.Page) -> tuple[str, RenderedPage | list]:
+        """
+        Work out how to read a page: from the text layer of born-digital pages, from
+        the page cache for pages seen before, or else by rendering it for OCR.
+        """
+        if self.use_text_layer:
+            lines = read_text_layer(page, self.text_layer_min_chars, self.text_layer_min_coverage)
+            if lines is not None:
+                return "text_layer", lines
+
+        rendered = self.render_page(page)
+        if self.use_page_cache:
+            rendered.cache_key = page_cache.key(rendered.array, rendered.zoom)
+            result = page_cache.get(rendered.cache_key)
+            if result is not None:
+                return "page_cache", result
+        return "ocr", rendered
+
+    def ocr_page(self, page: pymupdf.Page) -> tuple[list, RenderedPage]:
+        rendered = self.render_page(page)
+        result = self.ocr_images([rendered.array])[0]
+        return scale_boxes(result, OUTPUT_ZOOM / rendered.zoom), rendered
+
+    def ocr_images(self, images: list[np.ndarray], should_abort: Callable[[], bool] | None = None) -> list[list]:
+        """
+        Detect text on every image, then recognise the crops of all images in batched
+        recognizer runs. Mirrors PaddleOCR's TextSystem, so each result has the same
+        `[box, (text, score)]` layout as `model.ocr(...)[0]`. `should_abort` is polled after
+        detection on each image.
+        """
+        page_boxes = []
+        crops = []
+        for img in images:
+            dt_boxes, _ = self.model.text_detector(img)
+            dt_boxes = sorted_boxes(dt_boxes) if dt_boxes is not None else []
+            page_boxes.append(dt_boxes)
+            crops.extend(get_rotate_crop_image(img, box.copy()) for box in dt_boxes)
+            check_abort(should_abort)
+
+        rec_res, _ = self.model.text_recognizer(crops) if crops else ([], 0)
+
+        results = []
+        offset = 0
+        for dt_boxes in page_boxes:
+            page_res = rec_res[offset : offset + len(dt_boxes)]
+            offset += len(dt_boxes)
+            results.append(
+                [[box.tolist(), res] for box, res in zip(dt_boxes, page_res) if res[1] >= self.model.drop_score]
+            )
+        return results
+
+    def render_zoom(self, page: pymupdf.Page) -> float:
+        """Pick the render zoom for a page from its size and embedded images."""
+        zoom = self.render_dpi / 72
+
+        # A scanned page holds no more detail than its images, so don't upscale past the sharpest image that covers most
+        # of the page
+        native_zooms = [info["width"] / (info["bbox"][2] - info["bbox"][0]) for info in scanned_images(page)]
+        if native_zooms:
+            zoom = min(zoom, max(native_zooms))
+        zoom = max(zoom, self.render_min_dpi / 72)
+
+        # Detection cost scales with pixel count, so large formats are capped
+        return min(zoom, math.sqrt(self.render_max_pixels / page.rect.get_area()))
 
-        return self.model.ocr(np.array(img), cls=False)[0], img
+    def render_page(self, page: pymupdf.Page) -> RenderedPage:
+        zoom = self.render_zoom(page)
+        mat = pymupdf.Matrix(zoom, zoom)
+        return RenderedPage(page.get_pixmap(matrix=mat, alpha=False), zoom)
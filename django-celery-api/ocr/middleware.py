@@ -0,0 +1,107 @@
+import zlib
+from typing import AsyncIterator, Iterable, Iterator
+
+import zstandard
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.decorators import decorator_from_middleware
+from django.utils.deprecation import MiddlewareMixin
+
+# Content codings in order of preference
+ENCODINGS = ("zstd", "gzip")
+
+
+def accepted_encoding(header: str) -> str | None:
+    """The encoding of ENCODINGS an Accept-Encoding `header` gives the highest quality, if it accepts any."""
+    qualities = {}
+    for part in header.split(","):
+        name, *params = (param.strip() for param in part.split(";"))
+        try:
+            qualities[name.lower()] = next((float(param[2:]) for param in params if param.startswith("q=")), 1.0)
+        except ValueError:
+            continue
+    # Encodings the header leaves out get the quality of "*", or none without one
+    quality = {encoding: qualities.get(encoding, qualities.get("*", 0.0)) for encoding in ENCODINGS}
+    # max keeps the first of equals, so ties go by ENCODINGS order
+    best = max(ENCODINGS, key=quality.get)
+    return best if quality[best] > 0 else None
+
+
+class Compressor:
+    """Incremental compressor for one response body, flushing after each chunk so streams keep streaming."""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        self.level = level = settings.OCR_RESPONSE_COMPRESSION_LEVELS[encoding]
+        if encoding == "zstd":
+            self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+            self._flush_mode = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        else:
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self._flush_mode = zlib.Z_SYNC_FLUSH
+
+    def chunk(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(self._flush_mode)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+    def body(self, data: bytes) -> bytes:
+        # zstd frames compressed whole carry their size, which some decoders need
+        if self.encoding == "zstd":
+            return zstandard.ZstdCompressor(level=self.level).compress(data)
+        return self._compressor.compress(data) + self.finish()
+
+    def stream(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        for data in chunks:
+            yield self.chunk(data)
+        yield self.finish()
+
+    async def astream(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        async for data in chunks:
+            yield self.chunk(data)
+        yield self.finish()
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Compresses responses with zstd or gzip, whichever the client accepts, preferring zstd. Works like Django's
+    GZipMiddleware, which only knows gzip, and is applied to the result views with @compress_response.
+    """
+
+    min_length = 200
+
+    def process_response(self, request, response):
+        if response.has_header("Content-Encoding"):
+            return response
+        if not response.streaming and len(response.content) < self.min_length:
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        encoding = accepted_encoding(request.headers.get("Accept-Encoding", ""))
+        if encoding is None:
+            return response
+
+        compressor = Compressor(encoding)
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = compressor.astream(response.streaming_content)
+            else:
+                response.streaming_content = compressor.stream(response.streaming_content)
+            del response.headers["Content-Length"]
+        else:
+            compressed = compressor.body(response.content)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers["Content-Length"] = str(len(response.content))
+
+        # The compressed body is no longer byte for byte the one a strong ETag names
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+
+compress_response = decorator_from_middleware(CompressionMiddleware)
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.5 on 2026-10-18 12:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ocr', '0002_job_task_id_alter_job_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='result',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='file_count',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
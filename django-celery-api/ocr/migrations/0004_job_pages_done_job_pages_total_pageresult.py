@@ -0,0 +1,37 @@
+# Generated by Django 5.1.5 on 2026-10-18 12:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ocr', '0003_file_result_job_file_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='pages_done',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='pages_total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='PageResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document', models.PositiveIntegerField()),
+                ('page_number', models.PositiveIntegerField()),
+                ('result', models.JSONField()),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pages', to='ocr.job')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('job', 'document', 'page_number'), name='unique_job_page')],
+            },
+        ),
+    ]
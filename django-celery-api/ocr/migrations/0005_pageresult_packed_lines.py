@@ -0,0 +1,95 @@
+# Generated by Django 5.1.5 on 2026-10-18 13:30
+
+import json
+import zlib
+
+import numpy as np
+from django.db import migrations, models
+
+
+# Frozen copies of ocr.utils.parse_lines and pack_lines as of this migration, so later
+# changes to the storage format don't change what it writes
+def parse_lines(lines: list[dict]) -> tuple[list[str], np.ndarray]:
+    texts = [line["text"] for line in lines]
+    corners = [(*line["bbox"][0], *line["bbox"][2]) for line in lines]
+    return texts, np.asarray(corners, dtype=np.int64).reshape(-1, 4)
+
+
+def pack_lines(texts: list[str], bboxes: np.ndarray) -> tuple[bytes, bytes]:
+    texts_json = json.dumps(texts, ensure_ascii=False, separators=(",", ":"))
+    return zlib.compress(texts_json.encode()), np.asarray(bboxes, "<i4").tobytes()
+
+
+def summary(document: dict) -> dict:
+    return {"file_path": document["file_path"], "page_count": len(document["pages"])}
+
+
+def pack_results(apps, schema_editor):
+    """
+    Pack stored pages, and move the pages of completed jobs out of Job.result,
+    leaving a summary of each document.
+    """
+    Job = apps.get_model("ocr", "Job")
+    PageResult = apps.get_model("ocr", "PageResult")
+    for page in PageResult.objects.iterator():
+        page.texts, page.bboxes = pack_lines(*parse_lines(page.result["lines"]))
+        page.save(update_fields=["texts", "bboxes"])
+
+    for job in Job.objects.filter(status="completed").iterator():
+        documents = job.result["documents"]
+        if not any("pages" in document for document in documents):
+            continue
+        if not job.pages.exists():
+            # Completed from the result cache, so pages were never stored one by one
+            pages = []
+            for i, document in enumerate(documents):
+                for page in document["pages"]:
+                    texts, bboxes = pack_lines(*parse_lines(page["lines"]))
+                    pages.append(
+                        PageResult(
+                            job=job,
+                            document=i,
+                            page_number=page["page_number"],
+                            # Until the field is removed below
+                            result=page,
+                            texts=texts,
+                            bboxes=bboxes,
+                        )
+                    )
+            PageResult.objects.bulk_create(pages)
+        job.result["documents"] = [summary(document) for document in documents]
+        job.save(update_fields=["result"])
+
+    File = apps.get_model("ocr", "File")
+    for file in File.objects.filter(result__isnull=False).iterator():
+        document = file.result["document"]
+        if "pages" in document:
+            file.result["document"] = summary(document)
+            file.save(update_fields=["result"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ocr', '0004_job_pages_done_job_pages_total_pageresult'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pageresult',
+            name='bboxes',
+            field=models.BinaryField(default=b''),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='pageresult',
+            name='texts',
+            field=models.BinaryField(default=b''),
+            preserve_default=False,
+        ),
+        migrations.RunPython(pack_results),
+        migrations.RemoveField(
+            model_name='pageresult',
+            name='result',
+        ),
+    ]
@@ -3,6 +3,8 @@ import time
 from django.conf import settings
 from django.db import models
 
+from .utils import Page, format_columns, format_page, pack_lines, parse_lines, unpack_lines
+
 
 def generate_job_id():
     """Generate a job ID combining app label and timestamp"""
@@ -23,8 +25,14 @@ class Job(models.Model):
     id = models.CharField(primary_key=True, default=generate_job_id, max_length=100, editable=False)
     task_id = models.CharField(max_length=30, null=True, blank=True)
     multi_doc = models.BooleanField(default=False)
+    # Number of files once a zip upload is fully extracted, for jobs OCRed file by file
+    file_count = models.PositiveIntegerField(null=True, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="pending")
+    # A message, and once completed page stats and a summary of each document, whose pages are stored as PageResults
     result = models.JSONField(null=True, blank=True)
+    # Progress, counted as pages are stored in PageResult
+    pages_done = models.PositiveIntegerField(default=0)
+    pages_total = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -33,6 +41,45 @@ class File(models.Model):
     job = models.ForeignKey(Job, on_delete=models.CASCADE, related_name="files")
     file = models.FileField(upload_to="uploaded_files/")  # Relative to MEDIA_ROOT
     description = models.CharField(max_length=255, blank=True)  # Optional description
+    # Document summary and page stats, for jobs OCRed file by file
+    result = models.JSONField(null=True, blank=True)
 
     def __str__(self):
         return self.file.name
+
+
+class PageResult(models.Model):
+    """
+    A page of a job, stored as soon as it is OCRed. Lines are stored column-wise by
+    pack_lines rather than as formatted JSON, at a fraction of the size, and formatted
+    again when read.
+    """
+
+    job = models.ForeignKey(Job, on_delete=models.CASCADE, related_name="pages")
+    # Index of the page's document in Job.result["documents"]
+    document = models.PositiveIntegerField()
+    page_number = models.PositiveIntegerField()
+    texts = models.BinaryField()
+    bboxes = models.BinaryField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["job", "document", "page_number"], name="unique_job_page")]
+
+    @classmethod
+    def from_page(cls, job_id: str, document: int, page: Page) -> "PageResult":
+        texts, bboxes = pack_lines(page.texts, page.bboxes)
+        return cls(job_id=job_id, document=document, page_number=page.page_number, texts=texts, bboxes=bboxes)
+
+    @classmethod
+    def from_result(cls, job_id: str, document: int, result: dict) -> "PageResult":
+        """A page from its formatted result, as the result cache holds it."""
+        texts, bboxes = pack_lines(*parse_lines(result["lines"]))
+        return cls(job_id=job_id, document=document, page_number=result["page_number"], texts=texts, bboxes=bboxes)
+
+    @property
+    def result(self) -> dict:
+        return format_page(self.page_number, *unpack_lines(self.texts, self.bboxes))
+
+    @property
+    def columns(self) -> dict:
+        return format_columns(self.page_number, *unpack_lines(self.texts, self.bboxes))
@@ -0,0 +1,72 @@
+from typing import AsyncIterator, Callable
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Count, F, Subquery
+from django.utils import timezone
+
+from .events import notify_job
+from .models import Job, PageResult
+from .utils import Page
+
+
+def add_pages_total(job_id: str, pages: int):
+    Job.objects.filter(id=job_id).update(pages_total=F("pages_total") + pages, updated_at=timezone.now())
+
+
+def page_recorder(job_id: str, document: int = 0) -> Callable[[list[Page]], None]:
+    """Callback for OcrEngine.ocr_pages: store each batch of pages as it is done and count it as progress."""
+
+    def record(pages: list[Page]):
+        PageResult.objects.bulk_create(
+            [PageResult.from_page(job_id, document, page) for page in pages], ignore_conflicts=True
+        )
+        # Progress is recounted from the pages stored, as a redelivered task stores pages already counted again
+        stored = PageResult.objects.filter(job_id=job_id).values("job_id").annotate(count=Count("pk")).values("count")
+        Job.objects.filter(id=job_id).update(pages_done=Subquery(stored), updated_at=timezone.now())
+        notify_job(job_id)
+
+    return record
+
+
+def job_pages(job: Job, offset: int = 0, limit: int | None = None, columnar: bool = False) -> list[dict]:
+    """
+    Pages of `job` done so far, in order from `offset`, each as its formatted result plus its document index.
+    Columnar pages have their lines column-wise, as format_columns gives them.
+    """
+    stop = offset + limit if limit is not None else None
+    rows = job.pages.order_by("document", "page_number")[offset:stop]
+    return [{"document": row.document, **(row.columns if columnar else row.result)} for row in rows]
+
+
+async def iter_job_pages(job: Job, offset: int = 0, columnar: bool = False) -> AsyncIterator[list[dict]]:
+    """
+    All pages of `job` done so far from `offset` on, a chunk at a time. Async, as the ASGI server reads a sync iterator
+    to the end before sending any of it.
+    """
+    limit = settings.OCR_PAGES_MAX_LIMIT
+    while pages := await sync_to_async(job_pages)(job, offset, limit, columnar):
+        yield pages
+        offset += len(pages)
+
+
+def job_documents(job: Job, columnar: bool = False) -> list[dict]:
+    """Formatted documents of a completed job: its document summaries filled in with their stored pages."""
+    documents = [{"file_path": summary["file_path"], "pages": []} for summary in job.result["documents"]]
+    for row in job.pages.order_by("document", "page_number").iterator():
+        documents[row.document]["pages"].append(row.columns if columnar else row.result)
+    return documents
+
+
+def full_result(job: Job) -> dict:
+    """Result of a completed job with every page in it, as the result cache holds it."""
+    return {**job.result, "documents": job_documents(job)}
+
+
+def store_documents(job_id: str, documents: list[dict]) -> list[dict]:
+    """Store the pages of formatted `documents` for `job_id`, and return the summaries the job keeps of them."""
+    PageResult.objects.bulk_create(
+        [PageResult.from_result(job_id, i, page) for i, document in enumerate(documents) for page in document["pages"]],
+        ignore_conflicts=True,
+    )
+    return [{"file_path": document["file_path"], "page_count": len(document["pages"])} for document in documents]
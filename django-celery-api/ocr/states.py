@@ -0,0 +1,48 @@
+from typing import Iterable
+
+from django.utils import timezone
+
+from .events import notify_job
+from .models import Job
+
+# Statuses a job can move to from each status. Final statuses lead nowhere
+TRANSITIONS = {
+    "pending": ("extracting", "processing", "completed", "failed", "aborted"),
+    "extracting": ("processing", "failed", "aborted"),
+    "processing": ("completed", "failed", "aborted"),
+}
+
+
+def transition(
+    job: Job | str, status: str, expected: Iterable[str] | None = None, where: dict | None = None, **fields
+) -> bool:
+    """
+    Move a job to `status`, setting `fields` along with it, if it is in one of the `expected` statuses, by default
+    any that can lead to `status`, and matches the `where` lookups. This is one conditional UPDATE of only those
+    columns, a compare-and-set: of concurrent transitions of a job only one wins, and jobs that were aborted or
+    finished meanwhile are left alone. Returns whether the job moved, in which case its watchers are notified and,
+    given a Job, the instance is updated too.
+    """
+    if expected is None:
+        expected = [source for source, targets in TRANSITIONS.items() if status in targets]
+    job_id = job.id if isinstance(job, Job) else job
+    fields = {"status": status, "updated_at": timezone.now(), **fields}
+    moved = Job.objects.filter(id=job_id, status__in=expected, **(where or {})).update(**fields)
+    if not moved:
+        return False
+
+    if isinstance(job, Job):
+        for name, value in fields.items():
+            setattr(job, name, value)
+    notify_job(job_id)
+    return True
+
+
+def update_job(job: Job | str, **fields):
+    """Set `fields` of a job, and of the instance given a Job, writing only those columns."""
+    fields = {"updated_at": timezone.now(), **fields}
+    if isinstance(job, Job):
+        for name, value in fields.items():
+            setattr(job, name, value)
+        job = job.id
+    Job.objects.filter(id=job).update(**fields)
@@ -1,22 +1,52 @@
 import logging
-import time
-import zipfile
-from io import BytesIO
+from collections import Counter
 from pathlib import Path
+from typing import Callable
 
-from celery import shared_task
+from billiard.process import current_process
+from celery import chord, group, shared_task
 from celery.contrib.abortable import AbortableTask
+from celery.signals import worker_process_init
 from django.conf import settings
 from django.core.cache import cache
-from django.core.files.base import ContentFile
+from django.core.files.base import File as DjangoFile
 from django.core.files.uploadedfile import UploadedFile
 
-from .inference import OcrEngine
+from .cache import page_cache, result_cache
+from .inference import OcrAborted, OcrEngine, pin_worker
 from .models import File, Job
+from .progress import add_pages_total, full_result, page_recorder
+from .states import transition
+from .utils import UnsafeZipError, count_pages, iter_zip_members, read_file
 
 logger = logging.getLogger(settings.APP_NAME)
 
 
+# The engine of this worker process, shared by all ML tasks
+_ocr_engine: OcrEngine | None = None
+
+
+def load_ocr_engine() -> OcrEngine:
+    global _ocr_engine
+    if _ocr_engine is None:
+        logger.info("Loading OCR Engine...")
+        _ocr_engine = OcrEngine()
+        if settings.OCR_WARM_UP:
+            _ocr_engine.warm_up()
+        logger.info("OCR Model loaded")
+    return _ocr_engine
+
+
+@worker_process_init.connect
+def preload_ocr_engine(**kwargs):
+    """
+    Load the engine as each prefork child starts rather than on its first task. Not in the parent before
+    forking, as ONNX Runtime sessions don't survive a fork.
+    """
+    pin_worker(current_process().index)
+    load_ocr_engine()
+
+
 # Task class to load models
 class MLTask(AbortableTask):
     """
@@ -25,20 +55,13 @@ class MLTask(AbortableTask):
 
     abstract = True
 
-    def __init__(self):
-        super().__init__()
-        self.ocr_engine = None
-
-    def __call__(self, *args, **kwargs):
-        if not self.ocr_engine:
-            logging.info("Loading OCR Engine...")
-            self.ocr_engine = OcrEngine()
-            logging.info("OCR Model loaded")
-        return self.run(*args, **kwargs)
+    @property
+    def ocr_engine(self) -> OcrEngine:
+        return load_ocr_engine()
 
 
 @shared_task(bind=True, base=MLTask)
-def process_path_task(self: MLTask, job_id: str):
+def process_path_task(self: MLTask, job_id: str, cache_key: str | None = None):
     """Celery task to process a path."""
     logger.info(f"Request: {self.request.id}")
     # logger.info(f"Request: {self.request!r}")
@@ -46,70 +69,248 @@ def process_path_task(self: MLTask, job_id: str):
     job = Job.objects.get(id=job_id)
     files = job.files.all()  # Get all related MyFile instances
     logger.info(f"{job_id=} | {len(files)=} | {job.multi_doc=}")
+    if job.status == "aborted":
+        logger.info(f"Task {self.request.id} skipped, {job_id=} was aborted.")
+        return
+
+    paths = [f.file.path for f in files]
+    page_counts = [count_pages(path) for path in paths]
 
-    # Update status to processing
-    job.status = "processing"
-    job.task_id = self.request.id
-    job.save()
+    # Zip uploads are extracted by process_file_task first
+    started = transition(
+        job, "processing", ["pending", "extracting"], task_id=self.request.id, pages_total=sum(page_counts)
+    )
+    if not started:
+        logger.info(f"Task {self.request.id} skipped, {job_id=} was aborted or already started.")
+        return
 
+    ranges = page_ranges(paths, page_counts, job.multi_doc)
+    if ranges is not None:
+        # Large job: OCR page ranges in parallel and let the chord callback complete it
+        logger.info(f"{job_id=} | Fanning out {len(ranges)} page ranges")
+        file_paths = [Path(paths[0]).parent.as_posix()] if job.multi_doc else paths
+        merge = merge_page_ranges_task.s(job_id=job_id, file_paths=file_paths, cache_key=cache_key)
+        header = group(ocr_page_range_task.s(*r, job_id=job_id) for r in ranges)
+        chord(header)(merge.on_error(fail_job_task.s(job_id=job_id)))
+        return
+
+    should_abort = abort_requested(job_id)
     documents = []
-    if len(files) > 1:
-        if job.multi_doc:
-            ocr_result = self.ocr_engine.ocr_document_multi(Path(files[0].file.path).parent.as_posix())
-            documents.append(ocr_result.formatted_results)
+    page_stats = Counter()
+    try:
+        if len(files) > 1:
+            if job.multi_doc:
+                # Uploads of every job share a directory, so only this job's files are read from it
+                input_dir = Path(paths[0]).parent.as_posix()
+                ocr_result = self.ocr_engine.ocr_document_multi(
+                    input_dir, stats=page_stats, should_abort=should_abort, on_pages=page_recorder(job_id), files=paths
+                )
+                documents.append(ocr_result.summary)
+            else:
+                for i, f in enumerate(files):
+                    ocr_result = self.ocr_engine.ocr_document(
+                        f.file.path, stats=page_stats, should_abort=should_abort, on_pages=page_recorder(job_id, i)
+                    )
+                    documents.append(ocr_result.summary)
+
         else:
-            for f in files:
-                time.sleep(60)
-                if self.is_aborted():  # Check if the task has been marked for abortion
-                    job.status = "aborted"
-                    job.save()
-                    logger.info(f"Task {self.request.id} aborted.")
-                    return
-                ocr_result = self.ocr_engine.ocr_document(f.file.path)
-                documents.append(ocr_result.formatted_results)
+            ocr_result = self.ocr_engine.ocr_document(
+                files[0].file.path, stats=page_stats, should_abort=should_abort, on_pages=page_recorder(job_id)
+            )
+            documents.append(ocr_result.summary)
+    except OcrAborted:
+        logger.info(f"Task {self.request.id} aborted.")
+        return
+    except Exception as e:
+        # Nothing else fails a job OCRed by this task alone, and its watchers would wait on it forever
+        logger.error(f"{job_id=} | Task {self.request.id} failed: {e!r}")
+        transition(job, "failed", ["processing"], result={"message": f"Processing failed: {e}"})
+        raise
 
-    else:
-        ocr_result = self.ocr_engine.ocr_document(files[0].file.path)
-        documents.append(ocr_result.formatted_results)
+    complete_job(job, documents, page_stats, cache_key)
 
-    # Update with result
-    job.status = "completed"
-    job.result = {
+
+def abort_requested(job_id: str) -> Callable[[], bool]:
+    """Cancellation check for OcrEngine: has abort_task marked the job aborted?"""
+    return Job.objects.filter(id=job_id, status="aborted").exists
+
+
+def completed_result(documents: list[dict], page_stats: Counter) -> dict:
+    return {
         "documents": documents,
         "message": "Processing completed successfully",
+        "page_stats": page_cache.summary(page_stats),
     }
-    job.save()
+
+
+def complete_job(job: Job, documents: list[dict], page_stats: Counter, cache_key: str | None = None):
+    if not transition(job, "completed", result=completed_result(documents, page_stats)):
+        logger.info(f"{job.id=} | Not completed, it was aborted meanwhile")
+        return
+    logger.info(f"{job.id=} | page_stats={job.result['page_stats']}")
+
+    if cache_key:
+        result_cache.set(cache_key, full_result(job))
+
+
+def complete_if_done(job_id: str, cache_key: str | None = None) -> bool:
+    """
+    Complete a job OCRed file by file once all of its files have a result. The last file
+    task and the extraction task can both get here, so completing is a conditional update
+    that only one of them wins.
+    """
+    done = File.objects.filter(job_id=job_id, result__isnull=False)
+    if not Job.objects.filter(id=job_id, status="processing", file_count=done.count()).exists():
+        return False
+
+    results = list(done.order_by("id").values_list("result", flat=True))
+    documents = [result["document"] for result in results]
+    page_stats = sum((Counter(result["page_stats"]) for result in results), Counter())
+    job_result = completed_result(documents, page_stats)
+    if not transition(job_id, "completed", ["processing"], {"file_count": len(results)}, result=job_result):
+        return False
+
+    logger.info(f"{job_id=} | page_stats={job_result['page_stats']}")
+    if cache_key:
+        result_cache.set(cache_key, full_result(Job.objects.get(id=job_id)))
+    return True
+
+
+def page_ranges(paths: list[str], page_counts: list[int], multi_doc: bool) -> list[tuple] | None:
+    """
+    Split a job's files into `(document, path, start, stop, first_number)` ranges of at most
+    OCR_PAGE_CHUNK_SIZE pages, or None if the job is too small to be worth fanning out.
+    With `multi_doc` all files make up document 0 and page numbers run on across files.
+    """
+    chunk_size = settings.OCR_PAGE_CHUNK_SIZE
+    if not chunk_size or sum(page_counts) < settings.OCR_FANOUT_MIN_PAGES:
+        return None
+
+    ranges = []
+    offset = 0
+    for i, (path, page_count) in enumerate(zip(paths, page_counts)):
+        for start in range(0, page_count, chunk_size):
+            stop = min(start + chunk_size, page_count)
+            ranges.append((0 if multi_doc else i, path, start, stop, offset + start))
+        if multi_doc:
+            offset += page_count
+    return ranges
+
+
+@shared_task(bind=True, base=MLTask)
+def ocr_page_range_task(self: MLTask, document: int, path: str, start: int, stop: int, first_number: int, job_id: str):
+    """OCR pages `start` to `stop` of the file at `path`, numbered from `first_number`."""
+    logger.info(f"Request: {self.request.id} | {path=} | {start=} | {stop=}")
+    page_stats = Counter()
+    with read_file(path) as pdf:
+        pages = self.ocr_engine.ocr_pages(
+            pdf.pages(start, stop),
+            start=first_number,
+            stats=page_stats,
+            should_abort=abort_requested(job_id),
+            on_pages=page_recorder(job_id, document),
+        )
+    # Pages are stored as they are done, so only their count goes through the result backend
+    return {"document": document, "page_count": len(pages), "page_stats": dict(page_stats)}
+
+
+@shared_task
+def merge_page_ranges_task(range_results: list[dict], job_id: str, file_paths: list[str], cache_key: str | None = None):
+    """Chord callback: merge page range results, which arrive in range order, into the job's summary."""
+    documents = [{"file_path": file_path, "page_count": 0} for file_path in file_paths]
+    page_stats = Counter()
+    for range_result in range_results:
+        documents[range_result["document"]]["page_count"] += range_result["page_count"]
+        page_stats.update(range_result["page_stats"])
+
+    complete_job(Job.objects.get(id=job_id), documents, page_stats, cache_key)
+
+
+@shared_task(bind=True, base=MLTask)
+def ocr_file_task(self: MLTask, job_id: str, file_id: int, document: int, cache_key: str | None = None):
+    """
+    OCR one extracted file, the job's `document`th, into File.result, completing the job if it was the
+    last one.
+    """
+    logger.info(f"Request: {self.request.id} | {job_id=} | {file_id=}")
+    uploaded_file = File.objects.get(id=file_id)
+    add_pages_total(job_id, count_pages(uploaded_file.file.path))
+    page_stats = Counter()
+    ocr_result = self.ocr_engine.ocr_document(
+        uploaded_file.file.path,
+        stats=page_stats,
+        should_abort=abort_requested(job_id),
+        on_pages=page_recorder(job_id, document),
+    )
+    uploaded_file.result = {"document": ocr_result.summary, "page_stats": dict(page_stats)}
+    uploaded_file.save(update_fields=["result"])
+
+    complete_if_done(job_id, cache_key)
+
+
+@shared_task
+def fail_job_task(request, exc, traceback, job_id: str):
+    """Errback: mark a job failed when one of its page range or file tasks fails."""
+    if isinstance(exc, OcrAborted):
+        logger.info(f"{job_id=} | Task {request.id} aborted.")
+        return
+    logger.error(f"{job_id=} | Task {request.id} failed: {exc!r}")
+    transition(job_id, "failed", result={"message": f"Processing failed: {exc}"})
 
 
 @shared_task(bind=True, base=AbortableTask)
-def process_file_task(self: AbortableTask, job_id: str, filename: str, upload: str):
+def process_file_task(
+    self: AbortableTask, job_id: str, file_id: int, ocr_each: bool = False, cache_key: str | None = None
+):
+    """
+    Extract an uploaded zip archive, stored as File `file_id`, into one File per member.
+    With `ocr_each`, every member is handed to its own ocr_file_task as soon as it is
+    saved, so OCR overlaps with extracting the rest of the archive.
+    """
     logger.info(f"Request: {self.request.id}")
     # logger.info(f"Request: {self.request!r}")
     job = Job.objects.get(id=job_id)
-    job.status = "extracting"
-    job.save()
+    if not transition(job, "extracting", ["pending"], task_id=self.request.id):
+        logger.info(f"Task {self.request.id} skipped, {job_id=} was aborted.")
+        return job.id
 
     logger.info(f"{job_id=} | {job.multi_doc=}")
 
-    if filename.lower().endswith(".zip"):
-        with zipfile.ZipFile(BytesIO(upload)) as zip_file:
-            for file_info in zip_file.infolist():
-                # Skip directories
-                if file_info.is_dir():
-                    continue
-
-                file_name = file_info.filename
-                with zip_file.open(file_info) as extracted_file:
-                    # Create a MyFile instance and save the file
-                    uploaded_file = File(job=job)
-                    uploaded_file.file.save(file_name, ContentFile(extracted_file.read()))
-                    uploaded_file.save()
-
-    else:
-        uploaded_file = File(job=job)
-        uploaded_file.file.save(upload.name, ContentFile(upload))
-        uploaded_file.save()
+    archive = File.objects.get(id=file_id, job=job)
+    should_abort = abort_requested(job_id)
+    file_count = 0
+    try:
+        with archive.file.open("rb") as archive_file:
+            # Members are decompressed straight into storage in chunks
+            for file_name, extracted_file in iter_zip_members(archive_file):
+                if should_abort():
+                    logger.info(f"Task {self.request.id} aborted.")
+                    return job.id
+
+                uploaded_file = File(job=job)
+                uploaded_file.file.save(file_name, DjangoFile(extracted_file, file_name))
+                uploaded_file.save()
+                if ocr_each:
+                    ocr_file_task.apply_async(
+                        (job_id, uploaded_file.id, file_count),
+                        {"cache_key": cache_key},
+                        link_error=fail_job_task.s(job_id=job_id),
+                    )
+                file_count += 1
+    except UnsafeZipError as e:
+        logger.error(f"Rejected zip upload for {job_id=}: {e}")
+        transition(job, "failed", result={"message": f"Invalid zip archive: {e}"})
+        raise
+    finally:
+        # Only the extracted files are OCRed
+        archive.file.delete(save=False)
+        archive.delete()
 
     uploaded_files = [f.file.name for f in job.files.all()]
     logger.info(f"Saved file(s)\n{'\n\t'.join(uploaded_files)}\n to {job.id=}")
+
+    if ocr_each:
+        # Files may all be done already, in which case completing falls to this task
+        transition(job_id, "processing", ["extracting"], file_count=file_count)
+        complete_if_done(job_id, cache_key)
     return job.id
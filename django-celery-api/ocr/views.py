@@ -2,26 +2,56 @@ import logging
 import time
 from pathlib import Path
 
+from asgiref.sync import sync_to_async
 from celery import chain
 from celery.contrib.abortable import AbortableAsyncResult
 from django.conf import settings
 from django.core.files.base import ContentFile
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
 from rest_framework import status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, renderer_classes
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.request import Request
 from rest_framework.response import Response
 
+from .cache import digest_path, digest_upload, result_cache
+from .events import job_events, job_state
+from .middleware import compress_response
 from .models import File, Job
+from .progress import iter_job_pages, job_pages, store_documents
+from .renderers import (
+    ColumnarJSONRenderer,
+    MessagePackRenderer,
+    NDJSONRenderer,
+    ORJSONRenderer,
+    job_result_json,
+    ndjson_lines,
+)
 from .serializers import (
     JobSerializer,
     MultipartSerializer,
+    PagesQuerySerializer,
     PathSerializer,
 )
+from .states import transition, update_job
 from .tasks import process_file_task, process_path_task
 
 logger = logging.getLogger(settings.APP_NAME)
 
 
+def complete_from_cache(job: Job, cache_key: str) -> bool:
+    """Complete `job` straight away if the same input was OCRed before."""
+    cached = result_cache.get(cache_key)
+    if cached is None:
+        return False
+
+    logger.info(f"Result cache hit for {job.id=}")
+    documents = store_documents(job.id, cached["documents"])
+    pages = sum(document["page_count"] for document in documents)
+    return transition(job, "completed", result={**cached, "documents": documents}, pages_total=pages, pages_done=pages)
+
+
 # Create your views here.
 @api_view(["POST"])
 def ocr_job(request: Request):
@@ -36,7 +66,6 @@ def ocr_job(request: Request):
     logger.info(f"ocr_job POST request received with data: {request.data}")
 
     job = Job.objects.create()
-    job.save()
 
     logger.info(f"Created job with {job.id=}")
 
@@ -48,35 +77,53 @@ def ocr_job(request: Request):
             for key, error in request_serializer.errors.items():
                 logger.error({key: error})
 
-            job.status = "failed"
-            job.save()
+            transition(job, "failed")
             return Response(request_serializer.error_messages, status=status.HTTP_400_BAD_REQUEST)
 
         uploaded_file = request_serializer.validated_data["file"]
-        job.multi_doc = request_serializer.validated_data["single_file"]
-        job.save()
+        update_job(job, multi_doc=request_serializer.validated_data["single_file"])
+
+        cache_key = result_cache.key(digest_upload(uploaded_file), multi_doc=job.multi_doc)
+        if complete_from_cache(job, cache_key):
+            response_serializer = JobSerializer(job)
+            return Response(response_serializer.data, status=status.HTTP_201_CREATED)
+
+        # Stream the upload to storage here so that tasks only get its ID, not its bytes
+        stored_file = File(job=job)
+        stored_file.file.save(uploaded_file.name, uploaded_file)
 
         # Start processing in the background
-        # Create a Celery chain
-        task_chain = chain(
-            process_file_task.s(job_id=job.id, filename=uploaded_file.name, upload=uploaded_file.read()),
-            process_path_task.s(),
-        )
-        task_chain.apply_async()
+        if not uploaded_file.name.lower().endswith(".zip"):
+            process_path_task.delay(job.id, cache_key=cache_key)
+        elif job.multi_doc:
+            # All members make up one document, so OCR starts once extraction is done
+            # Create a Celery chain
+            task_chain = chain(
+                process_file_task.s(job_id=job.id, file_id=stored_file.id),
+                process_path_task.s(cache_key=cache_key),
+            )
+            task_chain.apply_async()
+        else:
+            # Each member is OCRed by its own task as soon as it is extracted
+            process_file_task.delay(job.id, stored_file.id, ocr_each=True, cache_key=cache_key)
         logger.info(f"Created background task for {job.id=} at {time.time() - start_time:.2f}s")
         response_serializer = JobSerializer(job)
         return Response(response_serializer.data, status=status.HTTP_201_CREATED)
 
     request_serializer = PathSerializer(data=request.data)
     if not request_serializer.is_valid():
-        job.result = request_serializer.error_messages
-        job.status = "failed"
-        job.save()
+        transition(job, "failed", result=request_serializer.error_messages)
         return Response(request_serializer.error_messages, status=status.HTTP_400_BAD_REQUEST)
 
     # Read in files
     input_path = Path(request_serializer.validated_data["path"])
-    job.multi_doc = input_path.is_dir() and not request_serializer.validated_data["single_file"]
+    update_job(job, multi_doc=input_path.is_dir() and not request_serializer.validated_data["single_file"])
+
+    cache_key = result_cache.key(digest_path(input_path), multi_doc=job.multi_doc)
+    if complete_from_cache(job, cache_key):
+        response_serializer = JobSerializer(job)
+        return Response(response_serializer.data, status=status.HTTP_201_CREATED)
+
     if input_path.is_dir():
         for f in input_path.glob("*"):
             with f.open("rb") as read_file:
@@ -89,12 +136,10 @@ def ocr_job(request: Request):
             uploaded_file.file.save(input_path.name, ContentFile(f.read()))
             uploaded_file.save()
 
-    job.save()
-
     logger.info(f"Validated path at {time.time() - start_time:.2f}s")
 
     # Start processing in the background
-    process_path_task.delay(job.id)
+    process_path_task.delay(job.id, cache_key=cache_key)
     logger.info(f"Created background task for {job.id=} at {time.time() - start_time:.2f}s")
 
     # Return the job ID immediately
@@ -102,22 +147,105 @@ def ocr_job(request: Request):
     return Response(response_serializer.data, status=status.HTTP_201_CREATED)
 
 
+@compress_response
 @api_view(["GET"])
+@renderer_classes([ORJSONRenderer, BrowsableAPIRenderer, ColumnarJSONRenderer, MessagePackRenderer])
 def ocr_result(request: Request, job_id):
+    """
+    A job and, once it is completed, its result. Completed jobs asked for as JSON are written straight from their
+    stored pages a chunk at a time, without building the whole result first. Clients asking for
+    application/vnd.ocr.columnar+json or application/msgpack (or ?format=columnar or msgpack) get the lines of each
+    page column-wise, in a fraction of the size.
+    """
     logger.info(f"ocr_result GET request received with {job_id=}")
 
     try:
         job = Job.objects.get(id=job_id)
-        serializer = JobSerializer(job)
-        return Response(serializer.data)
     except Job.DoesNotExist:
         return Response({"message": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
 
+    columnar = getattr(request.accepted_renderer, "columnar", False)
+    if job.status == "completed" and isinstance(request.accepted_renderer, ORJSONRenderer):
+        data = JobSerializer(job, context={"pages": False}).data
+        chunks = job_result_json(data, iter_job_pages(job, columnar=columnar))
+        return StreamingHttpResponse(chunks, content_type=request.accepted_renderer.media_type)
+
+    serializer = JobSerializer(job, context={"columnar": columnar})
+    return Response(serializer.data)
+
+
+@compress_response
+@api_view(["GET"])
+@renderer_classes([ORJSONRenderer, BrowsableAPIRenderer, NDJSONRenderer, ColumnarJSONRenderer, MessagePackRenderer])
+def ocr_result_pages(request: Request, job_id):
+    """
+    Pages of a job done so far, so clients can start on early pages while the rest are OCRed. Returns
+    `limit` pages from `offset` as JSON, or streams every page from `offset` on as NDJSON when asked for
+    application/x-ndjson (or ?format=ndjson). Pages come column-wise in the compact formats ocr_result offers.
+    """
+    logger.info(f"ocr_result_pages GET request received with {job_id=}")
+
+    query_serializer = PagesQuerySerializer(data=request.query_params)
+    if not query_serializer.is_valid():
+        return Response(query_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    offset = query_serializer.validated_data["offset"]
+    limit = query_serializer.validated_data["limit"]
+
+    try:
+        job = Job.objects.get(id=job_id)
+    except Job.DoesNotExist:
+        return Response({"message": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    if request.accepted_renderer.format == NDJSONRenderer.format:
+
+        async def lines():
+            async for pages in iter_job_pages(job, offset):
+                for line in ndjson_lines(pages):
+                    yield line
+
+        response = StreamingHttpResponse(lines(), content_type=NDJSONRenderer.media_type)
+        response["X-Job-Status"] = job.status
+        response["X-Pages-Done"] = job.pages_done
+        response["X-Pages-Total"] = job.pages_total
+        return response
+
+    pages = job_pages(job, offset, limit, getattr(request.accepted_renderer, "columnar", False))
+    return Response(
+        {
+            "id": job.id,
+            "status": job.status,
+            "pages_done": job.pages_done,
+            "pages_total": job.pages_total,
+            "next_offset": offset + len(pages),
+            "pages": pages,
+        }
+    )
+
+
+@require_GET
+async def ocr_result_events(request, job_id):
+    """
+    Server-sent events with a job's status and progress as they change, so clients can wait for the
+    result instead of polling ocr_result. A plain async Django view, since DRF views are sync and would
+    hold a worker thread for the whole stream.
+    """
+    logger.info(f"ocr_result_events GET request received with {job_id=}")
+
+    state = await sync_to_async(job_state)(job_id)
+    if state is None:
+        return JsonResponse({"message": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    response = StreamingHttpResponse(job_events(job_id, state), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Stop nginx from buffering events
+    response["X-Accel-Buffering"] = "no"
+    return response
+
 
 @api_view(["GET"])
 def health_check(request):
     logger.info("Health check request")
-    return Response({"status": "healthy"}, status=status.HTTP_200_OK)
+    return Response({"status": "healthy", "result_cache": result_cache.stats()}, status=status.HTTP_200_OK)
 
 
 @api_view(["POST"])
@@ -125,6 +253,9 @@ def abort_task(request, task_id):
     try:
         task = AbortableAsyncResult(task_id)
         task.abort()  # Mark the task as aborted
+        # Running OCR polls the job status between pages, including in subtasks
+        for job_id in Job.objects.filter(task_id=task_id).values_list("id", flat=True):
+            transition(job_id, "aborted")
         return Response({"task_id": task_id, "status": task.state}, status=status.HTTP_200_OK)
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
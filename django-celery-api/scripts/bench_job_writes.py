@@ -0,0 +1,178 @@
+"""
+Measure the database writes of job status updates: full-row saves against field-scoped transitions.
+
+Runs --jobs jobs of --pages pages through the writes process_path_task makes, from creating the job to completing
+it with its pages stored in batches along the way, --threads jobs at a time, on a scratch SQLite database in WAL
+mode. Each mode of updating the job is measured in turn:
+- save-full: job.save() after every change, with every page in Job.result as before pages were stored apart
+- save: job.save() after every change, with Job.result a summary
+- transition: ocr.states.transition and update_job, writing only the columns that changed
+Reports per job the statements made, the writes to its Job row and the bytes of the values sent with them, the bytes
+appended to the write-ahead log and wall time, and the number of jobs whose pages_done a full-row save overwrote
+with a stale count. Job events are not published.
+
+    python scripts/bench_job_writes.py
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from itertools import batched
+from pathlib import Path
+
+import django
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ocr_api.settings")
+
+MODES = ("save-full", "save", "transition")
+
+
+class QueryCounter:
+    """Database execute wrapper counting statements, and the writes to job rows with the bytes of their values."""
+
+    def __init__(self):
+        self.count = 0
+        self.job_writes = 0
+        self.job_bytes = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        job_write = sql.startswith(('INSERT INTO "ocr_job"', 'UPDATE "ocr_job"'))
+        with self._lock:
+            self.count += 1
+            if job_write:
+                self.job_writes += 1
+                self.job_bytes += sum(len(p) if isinstance(p, (str, bytes)) else 8 for p in params or ())
+        return execute(sql, params, many, context)
+
+
+def setup(db_path: Path):
+    from django.conf import settings
+
+    settings.DATABASES["default"]["NAME"] = db_path
+    django.setup()
+
+    from django.core.management import call_command
+    from django.db import connection
+    from django.db.backends.signals import connection_created
+
+    from ocr import progress, states
+
+    call_command("migrate", verbosity=0)
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA journal_mode=WAL")
+
+    # Keep every write in the log until it is measured
+    def no_checkpoints(connection, **kwargs):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA wal_autocheckpoint=0")
+
+    connection_created.connect(no_checkpoints)
+    no_checkpoints(connection)
+    progress.notify_job = states.notify_job = lambda job_id: None
+
+
+def fake_pages(pages: int, lines: int) -> list:
+    from ocr.utils import Page
+
+    def line(n: int, i: int) -> list:
+        top = 30 * i
+        box = [[40, top], [560, top], [560, top + 20], [40, top + 20]]
+        return [box, (f"Line {i} of page {n}, with a few more words on it", 0.9)]
+
+    return [Page(n, [line(n, i) for i in range(lines)]) for n in range(pages)]
+
+
+def run_job(mode: str, pages: list, batch_size: int, counter: QueryCounter):
+    """The job writes of process_path_task, with job updates made the way `mode` says."""
+    from django.db import connection
+
+    from ocr.models import Job
+    from ocr.progress import page_recorder
+    from ocr.states import transition, update_job
+    from ocr.utils import Document
+
+    document = Document("example.pdf", pages)
+    documents = [document.formatted_results if mode == "save-full" else document.summary]
+    result = {"documents": documents, "message": "Processing completed successfully", "page_stats": {}}
+    with connection.execute_wrapper(counter):
+        # Job IDs are millisecond timestamps, which collide when created in a loop
+        job = Job.objects.create(id=f"{mode}_{uuid.uuid4().hex}")
+        if mode == "transition":
+            update_job(job, multi_doc=False)
+            transition(job, "processing", task_id="bench", pages_total=len(pages))
+        else:
+            job.multi_doc = False
+            job.save()
+            job.status, job.task_id, job.pages_total = "processing", "bench", len(pages)
+            job.save()
+
+        record = page_recorder(job.id)
+        for batch in batched(pages, batch_size):
+            record(list(batch))
+
+        if mode == "transition":
+            transition(job, "completed", result=result)
+        else:
+            job.status, job.result = "completed", result
+            job.save()
+    connection.close()
+
+
+def measure(mode: str, db_path: Path, pages: list, args) -> tuple[QueryCounter, int, float, int]:
+    """
+    Statements made over all jobs, bytes appended to the write-ahead log, seconds taken and jobs whose progress
+    counters were overwritten.
+    """
+    from django.db import connection
+    from django.db.models import F
+
+    from ocr.models import Job
+
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    wal = Path(f"{db_path}-wal")
+    wal_start = wal.stat().st_size if wal.exists() else 0
+    counter = QueryCounter()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as pool:
+        for future in [pool.submit(run_job, mode, pages, args.batch_size, counter) for _ in range(args.jobs)]:
+            future.result()
+    seconds = time.perf_counter() - start
+    lost = Job.objects.filter(id__startswith=f"{mode}_").exclude(pages_done=F("pages_total")).count()
+    return counter, wal.stat().st_size - wal_start, seconds, lost
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--jobs", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--lines", type=int, default=40, help="Lines per page")
+    parser.add_argument("--batch-size", type=int, default=4, help="Pages stored at a time, like OCR_BATCH_SIZE")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = Path(tmp_dir) / "bench.sqlite3"
+        setup(db_path)
+        pages = fake_pages(args.pages, args.lines)
+        print(f"{args.jobs} jobs x {args.pages} pages of {args.lines} lines, {args.threads} at a time (per job)")
+        print(f"{'mode':>12} {'statements':>11} {'job writes':>11} {'job KB':>9} {'WAL KB':>9} {'ms':>8} {'lost':>5}")
+        for mode in args.modes:
+            counter, wal_bytes, seconds, lost = measure(mode, db_path, pages, args)
+            print(
+                f"{mode:>12} {counter.count / args.jobs:>11.1f} {counter.job_writes / args.jobs:>11.1f}"
+                f" {counter.job_bytes / 1024 / args.jobs:>9.1f} {wal_bytes / 1024 / args.jobs:>9.1f}"
+                f" {seconds * 1000 / args.jobs:>8.1f} {lost:>5}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Benchmark page layout on synthetic pages of 100, 1k and 10k lines.
+
+Compares the columnar Page with the previous Line-object layout (bubble-pass
+realignment, dict-scan text formatting) and checks that both produce the same lines
+and text. The old version is quadratic, so it only runs up to --legacy-max lines.
+
+    python scripts/bench_layout.py
+"""
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+from attrs import define, field
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+
+from ocr.utils import Page  # noqa: E402
+
+
+@define
+class LegacyLine:
+    text: str
+    input_bbox: list[list[float]] = field(repr=False)
+    y_top: int = field(init=False, repr=False)
+    y_bottom: int = field(init=False, repr=False)
+    x_left: int = field(init=False, repr=False)
+    x_right: int = field(init=False, repr=False)
+
+    output_bbox: list[tuple[int]] = field(init=False)
+
+    def __attrs_post_init__(self):
+        top_left, top_right, bottom_right, bottom_left = self.input_bbox
+
+        self.y_top = int(min(top_left[1], top_right[1]))
+        self.y_bottom = int(max(bottom_left[1], bottom_right[1]))
+        self.x_left = int(min(top_left[0], bottom_left[0]))
+        self.x_right = int(max(top_right[0], bottom_right[0]))
+
+        self.set_ouptut_bbox()
+
+    def set_ouptut_bbox(self):
+        top_left = (self.x_left, self.y_top)
+        top_right = (self.x_right, self.y_top)
+        bottom_right = (self.x_right, self.y_bottom)
+        bottom_left = (self.x_left, self.y_bottom)
+
+        self.output_bbox = [top_left, top_right, bottom_right, bottom_left]
+
+    def same_level(self, other: "LegacyLine", y_threshold: int = 20):
+        self_mid = (self.y_top + self.y_bottom) / 2
+        other_mid = (other.y_top + other.y_bottom) / 2
+        close_mid = abs(self_mid - other_mid) < y_threshold
+
+        self_height = self.y_bottom - self.y_top
+        other_height = other.y_bottom - other.y_top
+        close_height = abs(self_height - other_height) < y_threshold
+
+        return close_mid and close_height
+
+
+def legacy_realign_lines(lines: list[LegacyLine]):
+    for i in range(len(lines)):
+        for j in range(0, len(lines) - i - 1):
+            current_line = lines[j]
+            next_line = lines[j + 1]
+
+            if current_line.same_level(next_line):
+                lines[j + 1].y_top = current_line.y_top
+                lines[j + 1].y_bottom = current_line.y_bottom
+
+            lines[i + 1].set_ouptut_bbox()
+    return sorted(lines, key=lambda x: (x.y_top, x.x_left))
+
+
+def legacy_format_pdf_text(lines: list[LegacyLine]) -> str:
+    threshold = 10
+    line_groups = {}
+    min_x = min((line.x_left for line in lines), default=0)
+
+    for line in lines:
+        y = line.y_top
+        group_y = None
+        for existing_y in line_groups:
+            if abs(existing_y - y) < threshold:
+                group_y = existing_y
+                break
+        if group_y is None:
+            group_y = y
+        if group_y not in line_groups:
+            line_groups[group_y] = []
+        line_groups[group_y].append(line)
+
+    result = []
+    for y in sorted(line_groups.keys()):
+        lines_in_group = sorted(line_groups[y], key=lambda x: x.x_left)
+        current_x = min_x
+        line_text = ""
+        for line in lines_in_group:
+            spaces_needed = int((line.x_left - current_x) / 5)
+            line_text += " " * spaces_needed + line.text
+            current_x = line.x_right
+        result.append(line_text)
+
+    return "\n".join(result)
+
+
+def legacy_layout(result: list) -> tuple[list, str]:
+    lines = legacy_realign_lines([LegacyLine(box[1][0], box[0]) for box in result])
+    return [(line.text, line.output_bbox) for line in lines], legacy_format_pdf_text(lines)
+
+
+def columnar_layout(result: list) -> tuple[list, str]:
+    page = Page(0, result)
+    return [(line["text"], line["bbox"]) for line in page.formatted_lines], page.text
+
+
+def synthetic_result(n: int, seed: int = 0) -> list:
+    """Spreadsheet-like page as a raw OCR result: rows of cells with detection jitter."""
+    rng = random.Random(seed)
+    result = []
+    columns = 8
+    for i in range(n):
+        row, column = divmod(i, columns)
+        x = column * 150 + rng.uniform(-4, 4)
+        y = row * 30 + rng.uniform(-4, 4)
+        w = rng.uniform(40, 140)
+        h = rng.uniform(16, 24)
+        box = [[x, y], [x + w, y + rng.uniform(-2, 2)], [x + w, y + h], [x, y + h]]
+        result.append([box, (f"cell {i}", 0.9)])
+    return result
+
+
+def timed(fn, result: list) -> tuple[float, tuple[list, str]]:
+    start = time.perf_counter()
+    layout = fn(result)
+    return time.perf_counter() - start, layout
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1_000, 10_000])
+    parser.add_argument("--legacy-max", type=int, default=1_000)
+    args = parser.parse_args()
+
+    print(f"{'lines':>8} {'columnar':>10} {'legacy':>10} {'speedup':>8}")
+    for n in args.sizes:
+        result = synthetic_result(n)
+        new_time, new_layout = timed(columnar_layout, result)
+
+        if n > args.legacy_max:
+            print(f"{n:>8} {new_time:>9.4f}s {'skipped':>10} {'-':>8}")
+            continue
+
+        old_time, old_layout = timed(legacy_layout, result)
+        assert new_layout == old_layout, f"layouts differ for {n=}"
+        print(f"{n:>8} {new_time:>9.4f}s {old_time:>9.4f}s {old_time / new_time:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Measure the bytes on the wire and latency of GET /api/ocr/<id>/ for a large job with each response compression.
+
+Stores a completed job of --pages pages of --lines lines on a scratch SQLite database and serves the API on localhost
+with uvicorn, over ASGI as deployed, then fetches its result --requests times for each format and Accept-Encoding:
+none, gzip and zstd. Reports the bytes received, p50 and p99 time to the last byte, the time to decompress and decode
+the body as a client would, and the p50 plus the transfer time of those bytes over a --mbps link, since localhost
+hides it. Then reports the bytes the job takes at rest, in the page store and as a result cache entry, with each
+OCR_STORE_COMPRESSION codec.
+
+    python scripts/bench_result_compression.py --pages 500
+"""
+
+import argparse
+import gzip
+import http.client
+import json
+import os
+import random
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import django
+import msgpack
+import orjson
+import uvicorn
+import zstandard
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ocr_api.settings")
+
+FORMATS = {
+    "json": "application/json",
+    "columnar": "application/vnd.ocr.columnar+json",
+    "msgpack": "application/msgpack",
+}
+ENCODINGS = ("identity", "gzip", "zstd")
+WORDS = "invoice total amount due date account number payment reference customer address tax net gross".split()
+
+
+def setup(db_path: Path):
+    from django.conf import settings
+
+    settings.DATABASES["default"]["NAME"] = db_path
+    settings.ALLOWED_HOSTS = ["*"]
+    django.setup()
+
+    from django.core.management import call_command
+
+    call_command("migrate", verbosity=0)
+
+
+def fake_pages(pages: int, lines: int, words: int) -> list:
+    from ocr.utils import Page
+
+    rng = random.Random(0)
+
+    def line(i: int) -> list:
+        text = " ".join(rng.choices(WORDS, k=words))
+        x_left, y_top = rng.randrange(100, 400), 150 + 45 * i
+        x_right, y_bottom = min(x_left + 18 * len(text), 1550), y_top + 32
+        box = [[x_left, y_top], [x_right, y_top], [x_right, y_bottom], [x_left, y_bottom]]
+        return [box, (text, 0.9)]
+
+    return [Page(n, [line(i) for i in range(lines)]) for n in range(pages)]
+
+
+def create_job(pages: list):
+    from ocr.models import Job, PageResult
+    from ocr.utils import Document
+
+    job = Job.objects.create(id="bench", status="completed", pages_total=len(pages), pages_done=len(pages))
+    PageResult.objects.bulk_create([PageResult.from_page(job.id, 0, page) for page in pages])
+    summary = Document("example.pdf", pages).summary
+    job.result = {"documents": [summary], "message": "Processing completed successfully", "page_stats": {}}
+    job.save()
+    return job
+
+
+def serve() -> int:
+    """Serve the API from a background thread, returning its port."""
+    from django.core.asgi import get_asgi_application
+
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    server = uvicorn.Server(uvicorn.Config(get_asgi_application(), lifespan="off", log_level="warning"))
+    threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return sock.getsockname()[1]
+
+
+def fetch(port: int, path: str, media_type: str, encoding: str) -> tuple[bytes, str | None, float]:
+    """Body as received, its Content-Encoding and seconds to the last byte."""
+    start = time.perf_counter()
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    connection.request("GET", path, headers={"Accept": media_type, "Accept-Encoding": encoding})
+    response = connection.getresponse()
+    body = response.read()
+    seconds = time.perf_counter() - start
+    connection.close()
+    return body, response.getheader("Content-Encoding"), seconds
+
+
+def decode(body: bytes, encoding: str | None, result_format: str):
+    if encoding == "gzip":
+        body = gzip.decompress(body)
+    elif encoding == "zstd":
+        body = zstandard.ZstdDecompressor().decompressobj().decompress(body)
+    return msgpack.unpackb(body) if result_format == "msgpack" else orjson.loads(body)
+
+
+def percentile(values: list[float], p: float) -> float:
+    return statistics.quantiles(values, n=100, method="inclusive")[p - 1] if len(values) > 1 else values[0]
+
+
+def at_rest(job) -> dict[str, tuple[int | None, int]]:
+    """Bytes of the job's page store and of its result cache entry, uncompressed and with each codec."""
+    from django.test import override_settings
+
+    from ocr.models import PageResult
+    from ocr.progress import full_result
+    from ocr.utils import compress
+
+    result = full_result(job)
+    sizes = {"none": (None, len(json.dumps(result)))}
+    for codec in ("zlib", "zstd"):
+        with override_settings(OCR_STORE_COMPRESSION=codec):
+            rows = [PageResult.from_result(job.id, 0, page) for page in result["documents"][0]["pages"]]
+            store = sum(len(row.texts) + len(row.bboxes) for row in rows)
+            sizes[codec] = store, len(compress(json.dumps(result).encode()))
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--lines", type=int, default=40, help="Lines per page")
+    parser.add_argument("--words", type=int, default=4, help="Words per line")
+    parser.add_argument("--requests", type=int, default=50, help="Requests per format and encoding")
+    parser.add_argument("--mbps", type=float, default=100, help="Link speed for the modelled transfer time")
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=["json", "columnar"])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        setup(Path(tmp_dir) / "bench.sqlite3")
+        job = create_job(fake_pages(args.pages, args.lines, args.words))
+        port = serve()
+        path = f"/api/ocr/{job.id}/"
+
+        print(f"{args.pages} pages of {args.lines} lines of {args.words} words, {args.requests} requests each")
+        print(
+            f"{'format':>9} {'encoding':>9} {'wire KB':>9} {'p50 ms':>8} {'p99 ms':>8} {'decode ms':>10}"
+            f" {f'ms @ {args.mbps:g} Mbit/s':>18}"
+        )
+        for result_format in args.formats:
+            expected = None
+            for encoding in ENCODINGS:
+                times, decode_times = [], []
+                for _ in range(args.requests):
+                    body, content_encoding, seconds = fetch(port, path, FORMATS[result_format], encoding)
+                    start = time.perf_counter()
+                    data = decode(body, content_encoding, result_format)
+                    decode_times.append(time.perf_counter() - start)
+                    times.append(seconds)
+                expected = expected or data
+                if data != expected:
+                    sys.exit(f"{encoding} gives a different {result_format} result")
+                p50, p99 = percentile(times, 50), percentile(times, 99)
+                transfer = len(body) * 8 / (args.mbps * 1e6)
+                print(
+                    f"{result_format:>9} {content_encoding or 'identity':>9} {len(body) / 1024:>9.1f}"
+                    f" {p50 * 1000:>8.1f} {p99 * 1000:>8.1f} {statistics.median(decode_times) * 1000:>10.1f}"
+                    f" {(p50 + transfer) * 1000:>18.1f}"
+                )
+
+        print(f"\n{'at rest':>9} {'page store KB':>14} {'cache entry KB':>15}")
+        for codec, (store, entry) in at_rest(job).items():
+            store_kb = "-" if store is None else f"{store / 1024:.1f}"
+            print(f"{codec:>9} {store_kb:>14} {entry / 1024:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
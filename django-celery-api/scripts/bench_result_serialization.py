@@ -0,0 +1,152 @@
+"""
+Measure how long GET /api/ocr/<id>/ takes to render a large completed job, by each way of serializing it.
+
+Stores a completed job of --pages pages of --lines lines on a scratch SQLite database, then renders its response
+body, pages read from the database included, each way in turn:
+- drf: the nested DocumentSerializer, PageSerializer and LineSerializer walk rendered by DRF's JSONRenderer, as
+  before
+- orjson: JobSerializer, which takes the pages as they are formatted, rendered by ORJSONRenderer
+- stream: job_result_json writing the pages as they are read, as ocr_result does for JSON, sent from an event loop as
+  under ASGI
+Checks every way gives the same JSON, and reports the median time of --repeat runs, the size of the body and the
+peak memory allocated while rendering and sending it.
+
+    python scripts/bench_result_serialization.py --pages 500
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import AsyncIterable, Iterable
+
+import django
+from asgiref.sync import async_to_sync
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ocr_api.settings")
+
+MODES = ("drf", "orjson", "stream")
+
+
+def setup(db_path: Path):
+    from django.conf import settings
+
+    settings.DATABASES["default"]["NAME"] = db_path
+    django.setup()
+
+    from django.core.management import call_command
+
+    call_command("migrate", verbosity=0)
+
+
+def fake_pages(pages: int, lines: int) -> list:
+    from ocr.utils import Page
+
+    def line(n: int, i: int) -> list:
+        top = 30 * i
+        box = [[40, top], [560, top], [560, top + 20], [40, top + 20]]
+        return [box, (f"Line {i} of page {n}, with a few more words on it", 0.9)]
+
+    return [Page(n, [line(n, i) for i in range(lines)]) for n in range(pages)]
+
+
+def create_job(pages: list):
+    from ocr.models import Job, PageResult
+    from ocr.utils import Document
+
+    job = Job.objects.create(id="bench", status="completed", pages_total=len(pages), pages_done=len(pages))
+    PageResult.objects.bulk_create([PageResult.from_page(job.id, 0, page) for page in pages])
+    summary = Document("example.pdf", pages).summary
+    job.result = {"documents": [summary], "message": "Processing completed successfully", "page_stats": {}}
+    job.save()
+    return job
+
+
+def render(mode: str, job) -> Iterable[bytes] | AsyncIterable[bytes]:
+    """The response body for `job`, rendered the way `mode` says, in the chunks it is sent in."""
+    from rest_framework.renderers import JSONRenderer
+
+    from ocr.progress import iter_job_pages, job_documents
+    from ocr.renderers import ORJSONRenderer, job_result_json
+    from ocr.serializers import DocumentSerializer, JobSerializer
+
+    if mode == "drf":
+        data = JobSerializer(job, context={"pages": False}).data
+        data["result"]["documents"] = [DocumentSerializer(doc).data for doc in job_documents(job)]
+        return [JSONRenderer().render(data)]
+    if mode == "orjson":
+        return [ORJSONRenderer().render(JobSerializer(job).data)]
+    data = JobSerializer(job, context={"pages": False}).data
+    return job_result_json(data, iter_job_pages(job))
+
+
+def send(chunks: Iterable[bytes] | AsyncIterable[bytes]) -> int:
+    """Bytes in `chunks`, each dropped once counted as a response would send it."""
+    if isinstance(chunks, AsyncIterable):
+
+        async def send_async():
+            return sum([len(chunk) async for chunk in chunks])
+
+        return async_to_sync(send_async)()
+    return sum(len(chunk) for chunk in chunks)
+
+
+def body(chunks: Iterable[bytes] | AsyncIterable[bytes]) -> bytes:
+    if isinstance(chunks, AsyncIterable):
+
+        async def join():
+            return b"".join([chunk async for chunk in chunks])
+
+        return async_to_sync(join)()
+    return b"".join(chunks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--lines", type=int, default=40, help="Lines per page")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        setup(Path(tmp_dir) / "bench.sqlite3")
+        job = create_job(fake_pages(args.pages, args.lines))
+
+        expected = None
+        print(f"{args.pages} pages of {args.lines} lines, median of {args.repeat} runs")
+        print(f"{'mode':>8} {'ms':>9} {'speedup':>8} {'body MB':>8} {'peak MB':>8}")
+        baseline = None
+        for mode in args.modes:
+            content = body(render(mode, job))
+            if expected is None:
+                expected = json.loads(content)
+            elif json.loads(content) != expected:
+                sys.exit(f"{mode} renders a different result than {args.modes[0]}")
+
+            times = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                send(render(mode, job))
+                times.append(time.perf_counter() - start)
+            seconds = statistics.median(times)
+            baseline = baseline or seconds
+
+            tracemalloc.start()
+            send(render(mode, job))
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(
+                f"{mode:>8} {seconds * 1000:>9.1f} {baseline / seconds:>7.2f}x"
+                f" {len(content) / 2**20:>8.2f} {peak / 2**20:>8.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
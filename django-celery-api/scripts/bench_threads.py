@@ -0,0 +1,129 @@
+"""
+Benchmark OCR throughput across worker counts and ONNX Runtime session options.
+
+Runs every configuration of --workers worker processes on --cores cores, with intra-op
+threads either splitting the cores between workers or left to ONNX Runtime, under each
+graph optimization level, execution mode, spinning and pinning option given. Each worker
+loads its own OcrEngine, like a prefork Celery child, and all of them OCR the first
+--pages pages of --pdf at once, with the text layer and page cache off. Configurations
+are ranked by total pages per second.
+
+    python scripts/bench_threads.py --pdf examples/example.pdf
+"""
+
+import argparse
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from itertools import product
+from pathlib import Path
+
+import django
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ocr_api.settings")
+
+
+def run_worker(config: dict, slot: int, pdf: str, pages: int, barrier, results):
+    from django.conf import settings
+
+    django.setup()
+    for name, value in config.items():
+        setattr(settings, name, value)
+    settings.OCR_USE_TEXT_LAYER = False
+    settings.OCR_USE_PAGE_CACHE = False
+
+    from ocr.inference import OcrEngine, pin_worker
+    from ocr.utils import read_file
+
+    pin_worker(slot)
+    engine = OcrEngine()
+    engine.warm_up()
+    with read_file(pdf) as document:
+        # Start together, so workers compete for the cores as they would in production
+        barrier.wait()
+        start = time.perf_counter()
+        done = engine.ocr_pages(document.pages(0, min(pages, document.page_count)))
+        results.put((len(done), time.perf_counter() - start))
+
+
+def run_config(config: dict, workers: int, pdf: str, pages: int) -> float:
+    """Total pages per second of `workers` workers with `config` settings."""
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [
+        context.Process(target=run_worker, args=(config, slot, pdf, pages, barrier, results)) for slot in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    done = []
+    while len(done) < workers:
+        try:
+            done.append(results.get(timeout=1))
+        except queue.Empty:
+            if any(process.exitcode for process in processes):
+                # The others would wait at the barrier forever
+                for process in processes:
+                    process.terminate()
+                raise RuntimeError("A worker failed, see its traceback above")
+    for process in processes:
+        process.join()
+    return sum(pages for pages, _ in done) / max(seconds for _, seconds in done)
+
+
+def configs(args) -> list[tuple[int, dict]]:
+    matrix = []
+    for workers in args.workers:
+        options = product([args.cores // workers, 0], args.optimizations, args.execution_modes, args.spinning, args.pin)
+        for threads, optimization, execution_mode, spinning, pin in options:
+            if workers > args.cores or (pin and not threads):
+                continue
+            config = {
+                "OCR_ORT_INTRA_OP_THREADS": threads,
+                "OCR_ORT_INTER_OP_THREADS": 1,
+                "OCR_ORT_GRAPH_OPTIMIZATION": optimization,
+                "OCR_ORT_EXECUTION_MODE": execution_mode,
+                "OCR_ORT_ALLOW_SPINNING": spinning,
+                "OCR_PIN_WORKERS": pin,
+            }
+            matrix.append((workers, config))
+    return matrix
+
+
+def main():
+    cores = len(os.sched_getaffinity(0))
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pdf", default="examples/example.pdf")
+    parser.add_argument("--pages", type=int, default=8)
+    parser.add_argument("--cores", type=int, default=cores)
+    parser.add_argument("--workers", type=int, nargs="+", default=[w for w in (1, 2, 4, 8, 16) if w <= cores])
+    parser.add_argument("--optimizations", nargs="+", default=["ORT_ENABLE_ALL"])
+    parser.add_argument("--execution-modes", nargs="+", default=["ORT_SEQUENTIAL"])
+    parser.add_argument("--spinning", type=lambda v: v == "on", nargs="+", default=[True, False], help="on/off")
+    parser.add_argument("--pin", type=lambda v: v == "on", nargs="+", default=[False, True], help="on/off")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'workers':>8} {'threads':>8} {'optimization':>20} {'mode':>15} {'spin':>5} {'pin':>5} {'pages/s':>8}")
+    for workers, config in configs(args):
+        pages_per_second = run_config(config, workers, args.pdf, args.pages)
+        results.append((pages_per_second, workers, config))
+        spin, pin = ("on" if config[name] else "off" for name in ("OCR_ORT_ALLOW_SPINNING", "OCR_PIN_WORKERS"))
+        print(
+            f"{workers:>8} {config['OCR_ORT_INTRA_OP_THREADS'] or 'auto':>8}"
+            f" {config['OCR_ORT_GRAPH_OPTIMIZATION']:>20} {config['OCR_ORT_EXECUTION_MODE']:>15}"
+            f" {spin:>5} {pin:>5} {pages_per_second:>8.2f}"
+        )
+
+    pages_per_second, workers, config = max(results, key=lambda result: result[0])
+    print(f"\nBest on {args.cores} cores, {pages_per_second:.2f} pages/s: {workers} workers (--concurrency) with")
+    for name, value in config.items():
+        print(f"{name} = {value!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Compare the speed and accuracy of the INT8 models with the FP32 baseline.
+
+OCRs every file in --samples with an OcrEngine at each precision, with the text layer
+and page cache off, and reports pages per second and the character error rate (CER):
+edit distance over reference length, summed over the samples. CER is measured against
+the FP32 output, and against ground truth for samples with a transcription next to them
+(<sample>.txt). Make the INT8 models with scripts/quantize_models.py first.
+
+    python scripts/compare_precision.py --samples examples/pdf examples/png
+"""
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import django
+from rapidfuzz.distance import Levenshtein
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ocr_api.settings")
+
+
+def sample_files(paths: list[str]) -> list[Path]:
+    files = []
+    for path in map(Path, paths):
+        files += sorted(p for p in path.iterdir() if p.is_file()) if path.is_dir() else [path]
+    return [f for f in files if f.suffix != ".txt"]
+
+
+def run(precision: str, files: list[Path]) -> tuple[dict[Path, str], int, float]:
+    """Text OCRed from each file at `precision`, pages OCRed and seconds taken."""
+    from django.conf import settings
+
+    from ocr.inference import OcrEngine
+
+    settings.OCR_MODEL_PRECISION = precision
+    engine = OcrEngine()
+    engine.warm_up()
+    texts, pages = {}, 0
+    start = time.perf_counter()
+    for file in files:
+        document = engine.ocr_document(file.as_posix())
+        texts[file] = "\n".join(page.text for page in document.pages)
+        pages += len(document.pages)
+    return texts, pages, time.perf_counter() - start
+
+
+def cer(texts: dict[Path, str], references: dict[Path, str]) -> float | None:
+    """Character error rate of `texts` against `references`, over the files with one."""
+    errors = sum(Levenshtein.distance(texts[file], reference) for file, reference in references.items())
+    length = sum(len(reference) for reference in references.values())
+    return errors / length if length else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--samples", nargs="+", default=["examples/pdf"], help="Files or directories")
+    parser.add_argument("--precisions", nargs="+", choices=["fp32", "int8"], default=["fp32", "int8"])
+    args = parser.parse_args()
+
+    django.setup()
+    from django.conf import settings
+
+    settings.OCR_USE_TEXT_LAYER = False
+    settings.OCR_USE_PAGE_CACHE = False
+    files = sample_files(args.samples)
+    truth = {f: f.with_suffix(".txt").read_text() for f in files if f.with_suffix(".txt").exists()}
+    results = {precision: run(precision, files) for precision in args.precisions}
+    print(f"{len(files)} files, {len(truth)} with ground truth")
+
+    baseline = results.get("fp32")
+    print(f"{'precision':>10} {'pages':>6} {'pages/s':>8} {'speedup':>8} {'CER fp32':>9} {'CER truth':>10}")
+    for precision, (texts, pages, seconds) in results.items():
+        speedup = f"{(baseline[2] / seconds):.2f}x" if baseline else "-"
+        cers = [cer(texts, baseline[0]) if baseline else None, cer(texts, truth)]
+        cer_fp32, cer_truth = ("-" if value is None else f"{value:.2%}" for value in cers)
+        print(f"{precision:>10} {pages:>6} {pages / seconds:>8.2f} {speedup:>8} {cer_fp32:>9} {cer_truth:>10}")
+
+
+if __name__ == "__main__":
+    main()
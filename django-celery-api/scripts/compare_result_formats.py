@@ -0,0 +1,132 @@
+"""
+Compare the size, encode time and decode time of a job result in each format GET /api/ocr/<id>/ offers.
+
+Stores a completed job of --pages pages of --lines lines of --words words on a scratch SQLite database, with boxes
+the size of lines on an A4 page scanned at 200 dpi, then renders its result as the view does for each format:
+- json: the default, each line an object with a four-corner box
+- columnar: application/vnd.ocr.columnar+json, each page's line texts and extents as flat arrays
+- msgpack: application/msgpack, columnar
+Reports the size of each body, as is and gzipped, the median time of --repeat runs to render it, pages read from the
+database included, and to decode it as a client would, with orjson or msgpack.
+
+    python scripts/compare_result_formats.py --pages 500
+"""
+
+import argparse
+import gzip
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import django
+import msgpack
+from asgiref.sync import async_to_sync
+import orjson
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ocr_api.settings")
+
+FORMATS = ("json", "columnar", "msgpack")
+WORDS = "invoice total amount due date account number payment reference customer address tax net gross".split()
+
+
+def setup(db_path: Path):
+    from django.conf import settings
+
+    settings.DATABASES["default"]["NAME"] = db_path
+    django.setup()
+
+    from django.core.management import call_command
+
+    call_command("migrate", verbosity=0)
+
+
+def fake_pages(pages: int, lines: int, words: int) -> list:
+    from ocr.utils import Page
+
+    rng = random.Random(0)
+
+    def line(i: int) -> list:
+        text = " ".join(rng.choices(WORDS, k=words))
+        x_left, y_top = rng.randrange(100, 400), 150 + 45 * i
+        x_right, y_bottom = min(x_left + 18 * len(text), 1550), y_top + 32
+        box = [[x_left, y_top], [x_right, y_top], [x_right, y_bottom], [x_left, y_bottom]]
+        return [box, (text, 0.9)]
+
+    return [Page(n, [line(i) for i in range(lines)]) for n in range(pages)]
+
+
+def create_job(pages: list):
+    from ocr.models import Job, PageResult
+    from ocr.utils import Document
+
+    job = Job.objects.create(id="compare", status="completed", pages_total=len(pages), pages_done=len(pages))
+    PageResult.objects.bulk_create([PageResult.from_page(job.id, 0, page) for page in pages])
+    summary = Document("example.pdf", pages).summary
+    job.result = {"documents": [summary], "message": "Processing completed successfully", "page_stats": {}}
+    job.save()
+    return job
+
+
+def render(result_format: str, job) -> bytes:
+    from ocr.progress import iter_job_pages
+    from ocr.renderers import MessagePackRenderer, job_result_json
+    from ocr.serializers import JobSerializer
+
+    if result_format == "msgpack":
+        return MessagePackRenderer().render(JobSerializer(job, context={"columnar": True}).data)
+    data = JobSerializer(job, context={"pages": False}).data
+    chunks = job_result_json(data, iter_job_pages(job, columnar=result_format == "columnar"))
+
+    async def join():
+        return b"".join([chunk async for chunk in chunks])
+
+    return async_to_sync(join)()
+
+
+def decode(result_format: str, body: bytes) -> dict:
+    return msgpack.unpackb(body) if result_format == "msgpack" else orjson.loads(body)
+
+
+def median_seconds(function, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--lines", type=int, default=40, help="Lines per page")
+    parser.add_argument("--words", type=int, default=4, help="Words per line")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        setup(Path(tmp_dir) / "compare.sqlite3")
+        job = create_job(fake_pages(args.pages, args.lines, args.words))
+
+        print(f"{args.pages} pages of {args.lines} lines of {args.words} words, median of {args.repeat} runs")
+        print(f"{'format':>9} {'KB':>9} {'smaller':>8} {'gzip KB':>9} {'render ms':>10} {'decode ms':>10}")
+        baseline = None
+        for result_format in FORMATS:
+            body = render(result_format, job)
+            baseline = baseline or len(body)
+            gzipped = len(gzip.compress(body, compresslevel=6))
+            render_seconds = median_seconds(lambda: render(result_format, job), args.repeat)
+            decode_seconds = median_seconds(lambda: decode(result_format, body), args.repeat)
+            print(
+                f"{result_format:>9} {len(body) / 1024:>9.1f} {baseline / len(body):>7.2f}x {gzipped / 1024:>9.1f}"
+                f" {render_seconds * 1000:>10.1f} {decode_seconds * 1000:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
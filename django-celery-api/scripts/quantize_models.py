@@ -0,0 +1,136 @@
+"""
+Quantize the detection and recognition models to INT8 for OCR_MODEL_PRECISION = "int8".
+
+Writes the INT8 variant of each model next to it in --models-dir, as <model>_int8.onnx.
+Static quantization fixes activation ranges ahead of time, calibrated on the inputs the
+FP32 models see while OCRing the --calibration files, which suits the convolutional
+detector. Dynamic quantization needs no data but measures activation ranges on every
+run, which suits the recognizer, whose input width varies with each batch of crops.
+Needs the onnx package, which the API itself does not. Speedups depend on the CPU, and
+are largest on those with VNNI instructions; measure them and the accuracy cost with
+scripts/compare_precision.py.
+
+    python scripts/quantize_models.py --calibration examples/pdf
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import django
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ocr_api.settings")
+
+try:
+    from onnxruntime.quantization import (
+        CalibrationDataReader,
+        QuantFormat,
+        QuantType,
+        quantize_dynamic,
+        quantize_static,
+    )
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+except ImportError as e:
+    sys.exit(f"Quantization needs the onnx package (pip install onnx): {e}")
+
+
+class RecordingSession:
+    """InferenceSession wrapper keeping the inputs of its first `limit` runs."""
+
+    def __init__(self, session, limit: int):
+        self.session = session
+        self.limit = limit
+        self.inputs = []
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def run(self, output_names, input_feed, *args, **kwargs):
+        if len(self.inputs) < self.limit:
+            self.inputs.append(dict(input_feed))
+        return self.session.run(output_names, input_feed, *args, **kwargs)
+
+
+class InputsReader(CalibrationDataReader):
+    def __init__(self, inputs: list[dict]):
+        self._inputs = iter(inputs)
+
+    def get_next(self) -> dict | None:
+        return next(self._inputs, None)
+
+
+def input_files(paths: list[str]) -> list[Path]:
+    files = []
+    for path in map(Path, paths):
+        files += sorted(p for p in path.iterdir() if p.is_file()) if path.is_dir() else [path]
+    return files
+
+
+def calibration_inputs(files: list[Path], limit: int) -> dict[str, list[dict]]:
+    """Inputs of the FP32 det and rec models while OCRing `files`, up to `limit` runs each."""
+    from django.conf import settings
+
+    from ocr.inference import OcrEngine
+
+    settings.OCR_MODEL_PRECISION = "fp32"
+    settings.OCR_USE_TEXT_LAYER = False
+    settings.OCR_USE_PAGE_CACHE = False
+    engine = OcrEngine()
+    predictors = {"det": engine.model.text_detector, "rec": engine.model.text_recognizer}
+    for predictor in predictors.values():
+        predictor.predictor = RecordingSession(predictor.predictor, limit)
+    for file in files:
+        engine.ocr_document(file.as_posix())
+    return {name: predictor.predictor.inputs for name, predictor in predictors.items()}
+
+
+def quantize(fp32: Path, int8: Path, mode: str, inputs: list[dict]):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Shape inference and graph optimizations first, so more of the graph quantizes
+        prepared = Path(tmp_dir) / fp32.name
+        quant_pre_process(fp32.as_posix(), prepared.as_posix())
+        if mode == "static":
+            quantize_static(prepared, int8, InputsReader(inputs), quant_format=QuantFormat.QDQ, per_channel=True)
+        else:
+            # ConvInteger, which runs dynamically quantized convolutions on CPU, only takes uint8 weights
+            quantize_dynamic(prepared, int8, weight_type=QuantType.QUInt8)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--models-dir", type=Path)
+    parser.add_argument("--calibration", nargs="+", default=["examples/pdf"], help="Files or directories")
+    parser.add_argument("--calibration-runs", type=int, default=64, help="Inputs kept per model")
+    parser.add_argument("--det-mode", choices=["static", "dynamic"], default="static")
+    parser.add_argument("--rec-mode", choices=["static", "dynamic"], default="dynamic")
+    args = parser.parse_args()
+
+    django.setup()
+    from django.conf import settings
+
+    from ocr.utils import model_path
+
+    if args.models_dir is not None:
+        settings.PADDLE_MODELS_DIR = args.models_dir
+    modes = {"det": args.det_mode, "rec": args.rec_mode}
+    inputs = {"det": [], "rec": []}
+    if "static" in modes.values():
+        files = input_files(args.calibration)
+        inputs = calibration_inputs(files, args.calibration_runs)
+        counts = ", ".join(f"{len(model_inputs)} {name} inputs" for name, model_inputs in inputs.items())
+        print(f"Calibrated on {len(files)} files: {counts}")
+
+    for name, mode in modes.items():
+        fp32, int8 = model_path(name, "fp32"), model_path(name, "int8")
+        if mode == "static" and not inputs[name]:
+            sys.exit(f"No calibration inputs for {name}, are there files to OCR in {args.calibration}?")
+        quantize(fp32, int8, mode, inputs[name])
+        size = int8.stat().st_size / fp32.stat().st_size
+        print(f"{name}: {mode} quantization, wrote {int8} ({size:.0%} of FP32)")
+
+
+if __name__ == "__main__":
+    main()
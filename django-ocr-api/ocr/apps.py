@@ -1,5 +1,3 @@
-import os
-
 from django.apps import AppConfig
 from django.conf import settings
 from django.db.backends.signals import connection_created
@@ -12,12 +10,6 @@ class OcrConfig(AppConfig):
     label = settings.APP_NAME
 
     def ready(self):
-        # Do this check to avoid double loading when running in develoment mode
-        if os.environ.get("RUN_MAIN") != "true":
-            from .inference import OcrEngine
-
-            self.ocr_engine = OcrEngine()
-
         @receiver(connection_created, dispatch_uid="setup_sqlite_once")
         def setup_sqlite_pragmas(sender, connection, **kwargs):
             if connection.vendor == "sqlite":
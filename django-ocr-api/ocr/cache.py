@@ -0,0 +1,175 @@
+import hashlib
+import json
+import logging
+import time
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.uploadedfile import UploadedFile
+
+from .utils import compress, decompress, model_path
+
+logger = logging.getLogger(settings.APP_NAME)
+
+
+def engine_config() -> dict:
+    """Everything that changes what OcrEngine outputs, for keying cached results."""
+    models = {}
+    for name in settings.PADDLE_MODEL_FILES:
+        path = model_path(name)
+        size = path.stat().st_size if path.exists() else None
+        models[name] = [path.name, size]
+    return {
+        "models": models,
+        "render_dpi": settings.OCR_RENDER_DPI,
+        "render_min_dpi": settings.OCR_RENDER_MIN_DPI,
+        "render_max_pixels": settings.OCR_RENDER_MAX_PIXELS,
+        "use_text_layer": settings.OCR_USE_TEXT_LAYER,
+        "text_layer_min_chars": settings.OCR_TEXT_LAYER_MIN_CHARS,
+        "text_layer_min_coverage": settings.OCR_TEXT_LAYER_MIN_COVERAGE,
+    }
+
+
+def config_digest(**options) -> str:
+    config = json.dumps({**engine_config(), **options}, sort_keys=True)
+    return hashlib.sha256(config.encode()).hexdigest()[:16]
+
+
+def digest_upload(uploaded_file: UploadedFile) -> str:
+    """SHA-256 of an uploaded file, leaving it rewound for later reads."""
+    digest = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+    uploaded_file.seek(0)
+    return digest.hexdigest()
+
+
+def digest_path(input_path: Path) -> str:
+    """SHA-256 of a file, or of the names and contents of the files in a directory."""
+    if input_path.is_file():
+        with input_path.open("rb") as f:
+            return hashlib.file_digest(f, "sha256").hexdigest()
+
+    digest = hashlib.sha256()
+    for f in sorted(p for p in input_path.glob("*") if p.is_file()):
+        digest.update(f.name.encode())
+        digest.update(digest_path(f).encode())
+    return digest.hexdigest()
+
+
+class FallbackCache:
+    """
+    A cache alias that falls back to the local OCR_CACHE_FALLBACK alias on errors. After
+    an error the alias is left alone for OCR_CACHE_RETRY_AFTER seconds, so calls don't
+    each wait out a connect timeout while it is down.
+    """
+
+    # Monotonic time each failed alias is next tried at, shared by the caches using it
+    retry_at: dict[str, float] = {}
+
+    def __init__(self, alias: str):
+        self.alias = alias
+
+    def _call(self, method: str, *args):
+        if time.monotonic() >= self.retry_at.get(self.alias, 0):
+            try:
+                return getattr(caches[self.alias], method)(*args)
+            except Exception as e:
+                retry_after = settings.OCR_CACHE_RETRY_AFTER
+                self.retry_at[self.alias] = time.monotonic() + retry_after
+                logger.warning(f"Cache {self.alias!r} unavailable, using fallback: {e}")
+        return getattr(caches[settings.OCR_CACHE_FALLBACK], method)(*args)
+
+
+class ResultCache(FallbackCache):
+    """
+    Finished job results keyed by the SHA-256 of the input plus the engine config, so
+    a resubmitted file is answered without running OCR again.
+
+    Entries expire after OCR_RESULT_CACHE_TIMEOUT and results over
+    OCR_RESULT_CACHE_MAX_BYTES are not stored. Total size is bounded by the backend
+    itself (MAX_ENTRIES for locmem, maxmemory with an LRU policy for Redis).
+    """
+
+    prefix = "ocr:result"
+
+    def __init__(self):
+        super().__init__(settings.OCR_RESULT_CACHE)
+        self.timeout = settings.OCR_RESULT_CACHE_TIMEOUT
+        self.max_bytes = settings.OCR_RESULT_CACHE_MAX_BYTES
+
+    def key(self, digest: str, **options) -> str:
+        return f"{self.prefix}:{digest}:{config_digest(**options)}"
+
+    def get(self, key: str) -> dict | None:
+        payload = self._call("get", key)
+        self._count("hits" if payload is not None else "misses")
+        if payload is None:
+            return None
+        # Entries cached before results were compressed are JSON strings
+        return json.loads(payload if isinstance(payload, str) else decompress(payload))
+
+    def set(self, key: str, result: dict):
+        payload = compress(json.dumps(result).encode())
+        if len(payload) > self.max_bytes:
+            logger.info(f"Not caching {len(payload)} byte result for {key=}")
+            return
+        self._call("set", key, payload, self.timeout)
+
+    def stats(self) -> dict:
+        hits = self._call("get", f"{self.prefix}:hits") or 0
+        misses = self._call("get", f"{self.prefix}:misses") or 0
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / total if total else None,
+        }
+
+    def _count(self, counter: str):
+        key = f"{self.prefix}:{counter}"
+        self._call("add", key, 0, None)
+        self._call("incr", key)
+
+
+class PageCache(FallbackCache):
+    """
+    Raw OCR output of rendered pages keyed by a hash of their pixels, so pages that
+    recur across documents (cover sheets, T&Cs, letterheads) are only OCRed once.
+    """
+
+    prefix = "ocr:page"
+
+    def __init__(self):
+        super().__init__(settings.OCR_PAGE_CACHE)
+        self.timeout = settings.OCR_PAGE_CACHE_TIMEOUT
+
+    def key(self, pixels: np.ndarray, zoom: float) -> str:
+        digest = hashlib.blake2b(pixels, digest_size=20)
+        digest.update(f"{pixels.shape}:{zoom}".encode())
+        return f"{self.prefix}:{digest.hexdigest()}:{config_digest()}"
+
+    def get(self, key: str) -> list | None:
+        return self._call("get", key)
+
+    def set(self, key: str, result: list):
+        self._call("set", key, result, self.timeout)
+
+    @staticmethod
+    def summary(stats: Counter) -> dict:
+        """Page counts by source from OcrEngine.ocr_pages, with the cache hit ratio."""
+        hits, misses = stats["page_cache"], stats["ocr"]
+        total = hits + misses
+        return {
+            "text_layer": stats["text_layer"],
+            "page_cache": hits,
+            "ocr": misses,
+            "hit_ratio": hits / total if total else None,
+        }
+
+
+result_cache = ResultCache()
+page_cache = PageCache()
@@ -0,0 +1,102 @@
+import asyncio
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import AsyncIterator, Iterator
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .models import Job
+from .renderers import sse_event
+
+# Statuses after which a job never changes again
+FINAL_STATUSES = ("completed", "failed")
+
+
+def job_state(job_id: str) -> dict | None:
+    return (
+        Job.objects.filter(id=job_id)
+        .values("id", "status", "pages_done", "pages_total")
+        .first()
+    )
+
+
+class JobNotifier:
+    """
+    In-process publish/subscribe of job state, so clients can wait for the next
+    change instead of polling the database.
+
+    OCR progress is published from sync_to_async threads, so publishing is thread
+    safe and hands each state to its subscribers' event loops. This only reaches
+    clients served by the same process as the job.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: dict[str, set[tuple]] = defaultdict(set)
+
+    def publish(self, state: dict):
+        with self._lock:
+            subscribers = list(self._subscribers.get(state["id"], ()))
+        for loop, states in subscribers:
+            loop.call_soon_threadsafe(states.put_nowait, state)
+
+    @contextmanager
+    def subscribe(self, job_id: str) -> Iterator[asyncio.Queue]:
+        """Queue of the states published for `job_id` while the context is open."""
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue())
+        with self._lock:
+            self._subscribers[job_id].add(subscriber)
+        try:
+            yield subscriber[1]
+        finally:
+            with self._lock:
+                self._subscribers[job_id].discard(subscriber)
+                if not self._subscribers[job_id]:
+                    del self._subscribers[job_id]
+
+
+class RelayNotifier:
+    """
+    Stands in for job_notifier in JobScheduler worker processes, passing states on to
+    the web process to publish.
+    """
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def publish(self, state: dict):
+        self.queue.put(state)
+
+
+job_notifier = JobNotifier()
+
+
+def notify_job(job_id: str):
+    """Publish the current state of a job to anyone waiting on it."""
+    if state := job_state(job_id):
+        job_notifier.publish(state)
+
+
+async def job_events(job_id: str, state: dict) -> AsyncIterator[str]:
+    """
+    Server-sent events for a job: its current `state`, then every change until it
+    finishes, with keep-alive comments in between. The stream ends after
+    OCR_EVENTS_TIMEOUT seconds, and EventSource clients reconnect on their own.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.OCR_EVENTS_TIMEOUT
+    with job_notifier.subscribe(job_id) as states:
+        # Changes made before subscribing are covered by re-reading the state
+        state = await sync_to_async(job_state)(job_id) or state
+        yield sse_event("state", state)
+        while state["status"] not in FINAL_STATUSES and loop.time() < deadline:
+            try:
+                state = await asyncio.wait_for(
+                    states.get(), settings.OCR_EVENTS_HEARTBEAT
+                )
+            except TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            yield sse_event("state", state)
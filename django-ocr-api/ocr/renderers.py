@@ -0,0 +1,119 @@
+import json
+from typing import AsyncIterator, Iterable, Iterator
+
+import msgpack
+import orjson
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+def dumps(data, option: int | None = None) -> bytes:
+    """
+    JSON of `data` by orjson, falling back to DRF's encoder for the types only it
+    knows, like lazy translations in error messages.
+    """
+    return orjson.dumps(data, default=JSONEncoder().default, option=option)
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def ndjson_lines(rows: Iterable[dict]) -> Iterator[bytes]:
+    for row in rows:
+        yield dumps(row) + b"\n"
+
+
+async def job_result_json(
+    data: dict, pages: AsyncIterator[list[dict]]
+) -> AsyncIterator[bytes]:
+    """
+    JSON of a completed job, as JobSerializer gives it, written a chunk of pages at
+    a time. `data` is the job serialized without its pages and `pages` every page of
+    the job in order, in chunks as iter_job_pages reads them.
+    """
+    files = [document["file_path"] for document in data["result"]["documents"]]
+
+    def start(document: int) -> bytes:
+        # Closes the pages of the document before
+        head = dumps({"file_path": files[document], "pages": []})[: -len(b"]}")]
+        return b"]}," + head if document else head
+
+    result = {key: value for key, value in data["result"].items() if key != "documents"}
+    job = {key: value for key, value in data.items() if key != "result"}
+    # The job with an empty list of documents last, cut off inside it
+    yield dumps({**job, "result": {**result, "documents": []}})[: -len(b"]}}")]
+
+    document, first = -1, True
+    async for chunk in pages:
+        parts = []
+        for page in chunk:
+            while document < page["document"]:
+                document, first = document + 1, True
+                parts.append(start(document))
+            page = {key: value for key, value in page.items() if key != "document"}
+            parts.append((b"" if first else b",") + dumps(page))
+            first = False
+        yield b"".join(parts)
+    # Documents after the last page have none
+    parts = [start(document) for document in range(document + 1, len(files))]
+    yield b"".join(parts) + (b"]}" if files else b"") + b"]}}"
+
+
+class ORJSONRenderer(JSONRenderer):
+    """JSONRenderer by orjson, which renders large results several times faster."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        return dumps(data, orjson.OPT_INDENT_2 if indent else None)
+
+
+class ColumnarJSONRenderer(ORJSONRenderer):
+    """
+    JSON with the lines of each page column-wise, as format_columns gives them,
+    instead of as an object per line with a four-corner box. Views give pages in
+    that shape for renderers marked `columnar`.
+    """
+
+    media_type = "application/vnd.ocr.columnar+json"
+    format = "columnar"
+    columnar = True
+
+
+class MessagePackRenderer(BaseRenderer):
+    """MessagePack, with the lines of each page column-wise as ColumnarJSONRenderer."""
+
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+    columnar = True
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return msgpack.packb(data, default=JSONEncoder().default)
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Newline-delimited JSON, one object per line, for results streamed as they go."""
+
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        rows = data if isinstance(data, list) else [data]
+        return b"".join(ndjson_lines(rows))
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Server-sent events. Streams are written by the view; this renders errors."""
+
+    media_type = "text/event-stream"
+    format = "sse"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return sse_event("error", data).encode()
@@ -0,0 +1,153 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable
+
+from django.conf import settings
+
+from . import events
+from .states import transition
+from .worker import init_worker
+
+logger = logging.getLogger(settings.APP_NAME)
+
+
+class SchedulerFull(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Job queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class JobScheduler:
+    """
+    Runs OCR jobs on a fixed pool of OCR_WORKERS processes, each with its own
+    OcrEngine, so CPU-bound OCR neither oversubscribes the machine nor blocks the event
+    loop. Up to OCR_QUEUE_SIZE more jobs wait for a free worker, and submitting beyond
+    that raises SchedulerFull.
+
+    Processes are started by `start`, or else on the first job, and a pool broken by a
+    worker dying is replaced on the next one. Queued jobs only live in memory, so are
+    lost on restart.
+    """
+
+    def __init__(self):
+        self.workers = settings.OCR_WORKERS
+        self.queue_size = settings.OCR_QUEUE_SIZE
+        self.retry_after = settings.OCR_RETRY_AFTER
+        self._executor: ProcessPoolExecutor | None = None
+        # Finishing a job reads and writes the database, so is done here rather than on
+        # the executor's thread, which would hold up collecting every other job's result
+        self._completions = ThreadPoolExecutor(2, thread_name_prefix="ocr-completion")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._counts = {"submitted": 0, "rejected": 0, "completed": 0, "failed": 0}
+
+    def start(self):
+        """
+        Start every worker now rather than as jobs come in, so their engines are loaded
+        and warmed up before the first request.
+        """
+        with self._lock:
+            pool = self._pool()
+            for _ in range(self.workers):
+                pool.submit(os.getpid)
+
+    def check(self):
+        """Raise SchedulerFull if a job submitted now would be turned away."""
+        with self._lock:
+            self._check()
+
+    def submit(
+        self,
+        job_id: str,
+        fn: Callable,
+        *args,
+        on_success: Callable[[], None] | None = None,
+    ) -> Future:
+        """
+        Run `fn(*args)` for `job_id` on a worker process. Failures are logged and fail
+        the job, since nothing waits on the returned future. `on_success` is called in
+        this process once `fn` returns, for work such as filling this process's caches.
+        """
+        with self._lock:
+            self._check()
+            try:
+                future = self._pool().submit(fn, *args)
+            except BrokenProcessPool:
+                logger.warning("Worker pool broken, starting a new one")
+                self._executor = None
+                future = self._pool().submit(fn, *args)
+            self._pending += 1
+            self._counts["submitted"] += 1
+
+        future.add_done_callback(lambda f: self._done(job_id, f, on_success))
+        return future
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "running": min(self._pending, self.workers),
+                "queued": max(self._pending - self.workers, 0),
+                "queue_size": self.queue_size,
+                **self._counts,
+            }
+
+    def _check(self):
+        if self._pending >= self.workers + self.queue_size:
+            self._counts["rejected"] += 1
+            raise SchedulerFull(self.retry_after)
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Workers are forked from a server process that has imported the OCR
+            # modules but runs no threads, unlike this one, so they start fast and
+            # share those pages. Loaded engines can't be shared that way, as ONNX
+            # Runtime sessions don't survive a fork, so each worker loads its own
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload(["ocr.worker"])
+            notifications = context.SimpleQueue()
+            self._executor = ProcessPoolExecutor(
+                self.workers,
+                mp_context=context,
+                initializer=init_worker,
+                initargs=(notifications, context.Value("i", 0)),
+            )
+            threading.Thread(
+                target=self._relay, args=(notifications,), daemon=True
+            ).start()
+        return self._executor
+
+    @staticmethod
+    def _relay(notifications: multiprocessing.SimpleQueue):
+        """Publish job states from worker processes to clients of this one."""
+        while True:
+            events.job_notifier.publish(notifications.get())
+
+    def _done(self, job_id: str, future: Future, on_success: Callable[[], None] | None):
+        error = future.exception()
+        with self._lock:
+            self._pending -= 1
+            self._counts["completed" if error is None else "failed"] += 1
+        self._completions.submit(self._complete, job_id, error, on_success)
+
+    @staticmethod
+    def _complete(
+        job_id: str, error: BaseException | None, on_success: Callable[[], None] | None
+    ):
+        if error is None:
+            if on_success is not None:
+                try:
+                    on_success()
+                except Exception as e:
+                    logger.error(f"Completing job {job_id} failed: {e!r}")
+            return
+
+        logger.error(f"Job {job_id} failed: {error!r}")
+        transition(job_id, "failed", result={"message": f"Processing failed: {error}"})
+
+
+job_scheduler = JobScheduler()
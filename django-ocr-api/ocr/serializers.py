@@ -1,7 +1,9 @@
 from adrf.serializers import ModelSerializer, Serializer
+from django.conf import settings
 from rest_framework import serializers
 
 from .models import Job
+from .progress import job_documents
 
 __all__ = [
     "JobSerializer",
@@ -17,19 +19,33 @@ class JobSerializer(ModelSerializer):
 
     class Meta:
         model = Job
-        fields = ["id", "status", "result", "created_at", "updated_at"]
-        read_only_fields = ["id", "status", "result", "created_at", "updated_at"]
+        fields = [
+            "id",
+            "status",
+            "result",
+            "pages_done",
+            "pages_total",
+            "created_at",
+            "updated_at",
+        ]
+        read_only_fields = fields
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
 
         if instance.status == "completed":
-            # Multiple documents case
+            # Job.result only summarizes documents, whose pages are stored apart,
+            # already formatted as DocumentSerializer describes, or column-wise with
+            # columnar=True in the context. With pages=False they are left out for
+            # job_result_json
+            if self.context.get("pages", True):
+                documents = job_documents(instance, self.context.get("columnar", False))
+            else:
+                documents = instance.result["documents"]
             representation["result"] = {
-                "documents": [
-                    DocumentSerializer(doc).data for doc in instance.result["documents"]
-                ],
+                "documents": documents,
                 "message": instance.result["message"],
+                "page_stats": instance.result.get("page_stats"),
             }
 
         return representation
@@ -40,6 +56,15 @@ class PathSerializer(Serializer):
     single_file = serializers.BooleanField(default=True)
 
 
+class PagesQuerySerializer(Serializer):
+    offset = serializers.IntegerField(min_value=0, default=0)
+    limit = serializers.IntegerField(
+        min_value=1,
+        max_value=settings.OCR_PAGES_MAX_LIMIT,
+        default=settings.OCR_PAGES_LIMIT,
+    )
+
+
 class MultipartSerializer(Serializer):
     file = serializers.FileField()
     single_file = serializers.BooleanField(default=True)
@@ -0,0 +1,40 @@
+from typing import Iterable
+
+from django.utils import timezone
+
+from .events import notify_job
+from .models import Job
+
+# Statuses a job can move to from each status. Final statuses lead nowhere
+TRANSITIONS = {
+    "pending": ("processing", "completed", "failed"),
+    "processing": ("completed", "failed"),
+}
+
+
+def transition(
+    job: Job | str, status: str, expected: Iterable[str] | None = None, **fields
+) -> bool:
+    """
+    Move a job to `status`, setting `fields` along with it, if it is in one of the
+    `expected` statuses, by default any that can lead to `status`. This is one
+    conditional UPDATE of only those columns, a compare-and-set: of concurrent
+    transitions of a job only one wins, and finished jobs are left alone. Returns
+    whether the job moved, in which case its watchers are notified and, given a Job,
+    the instance is updated too.
+    """
+    if expected is None:
+        expected = [
+            source for source, targets in TRANSITIONS.items() if status in targets
+        ]
+    job_id = job.id if isinstance(job, Job) else job
+    fields = {"status": status, "updated_at": timezone.now(), **fields}
+    moved = Job.objects.filter(id=job_id, status__in=expected).update(**fields)
+    if not moved:
+        return False
+
+    if isinstance(job, Job):
+        for name, value in fields.items():
+            setattr(job, name, value)
+    notify_job(job_id)
+    return True
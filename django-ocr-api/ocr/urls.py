@@ -22,5 +22,7 @@ from . import views
 urlpatterns = [
     path("ocr/", views.ocr_job, name="ocr-process-file"),
     path("ocr/<str:job_id>/", views.ocr_result, name="ocr-get-result"),
+    path("ocr/<str:job_id>/pages/", views.ocr_result_pages, name="ocr-get-pages"),
+    path("ocr/<str:job_id>/events/", views.ocr_result_events, name="ocr-get-events"),
     path("", views.health_check, name="health-check"),
 ]
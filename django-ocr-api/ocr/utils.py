@@ -1,81 +1,105 @@
+import json
+import shutil
 import zipfile
+import zlib
+from itertools import count, pairwise
+from pathlib import Path
+from typing import IO, Iterator
 
+import numpy as np
 import pymupdf
 import requests
+import zstandard
 from attrs import define, field
-from django.core.files.uploadedfile import UploadedFile
-
-
-@define
-class Line:
-    text: str
-    input_bbox: list[list[float]] = field(repr=False)
-    y_top: int = field(init=False, repr=False)
-    y_bottom: int = field(init=False, repr=False)
-    x_left: int = field(init=False, repr=False)
-    x_right: int = field(init=False, repr=False)
-
-    output_bbox: list[tuple[int]] = field(init=False)
-
-    def __attrs_post_init__(self):
-        top_left, top_right, bottom_right, bottom_left = self.input_bbox
-
-        self.y_top = int(min(top_left[1], top_right[1]))
-        self.y_bottom = int(max(bottom_left[1], bottom_right[1]))
-        self.x_left = int(min(top_left[0], bottom_left[0]))
-        self.x_right = int(max(top_right[0], bottom_right[0]))
-
-        self.set_ouptut_bbox()
-
-    def set_ouptut_bbox(self):
-        top_left = (self.x_left, self.y_top)
-        top_right = (self.x_right, self.y_top)
-        bottom_right = (self.x_right, self.y_bottom)
-        bottom_left = (self.x_left, self.y_bottom)
-
-        self.output_bbox = [top_left, top_right, bottom_right, bottom_left]
-
-    def same_level(self, other: "Line", y_threshold: int = 20):
-        # Check if midpoints align
-        self_mid = (self.y_top + self.y_bottom) / 2
-        other_mid = (other.y_top + other.y_bottom) / 2
-        close_mid = abs(self_mid - other_mid) < y_threshold
-
-        # Check if box height align
-        self_height = self.y_bottom - self.y_top
-        other_height = other.y_bottom - other.y_top
-        close_height = abs(self_height - other_height) < y_threshold
-
-        return close_mid and close_height
+from django.conf import settings
+
+ZIP_CHUNK_SIZE = 1024 * 1024
+
+# Models with INT8 variants for OCR_MODEL_PRECISION = "int8"
+QUANTIZED_MODELS = ("det", "rec")
+
+# Magic number at the start of every zstd frame, which tells stored data's codec
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def line_extents(boxes: np.ndarray) -> np.ndarray:
+    """
+    Axis-aligned extents of `(n, 4, 2)` quads (top-left, top-right, bottom-right,
+    bottom-left) as an `(n, 4)` int array of `[x_left, y_top, x_right, y_bottom]`.
+    """
+    top_left, top_right, bottom_right, bottom_left = boxes.transpose(1, 0, 2)
+    extents = np.stack(
+        [
+            np.minimum(top_left[:, 0], bottom_left[:, 0]),
+            np.minimum(top_left[:, 1], top_right[:, 1]),
+            np.maximum(top_right[:, 0], bottom_right[:, 0]),
+            np.maximum(bottom_left[:, 1], bottom_right[:, 1]),
+        ],
+        axis=1,
+    )
+    # Truncate towards zero like int()
+    return extents.astype(np.int64)
+
+
+def realign_rows(extents: np.ndarray, y_threshold: int = 20) -> None:
+    """
+    Snap each line's y_top/y_bottom onto its predecessor (in detection order) when
+    their midpoints and heights are both within `y_threshold`.
+
+    Each comparison sees the already snapped predecessor, so this stays a single
+    sequential sweep, run over plain ints rather than array elements.
+    """
+    top = extents[:, 1].tolist()
+    bottom = extents[:, 3].tolist()
+    for i in range(1, len(top)):
+        # Midpoints are compared doubled to stay in integers
+        mid_gap = abs(top[i - 1] + bottom[i - 1] - top[i] - bottom[i])
+        height_gap = abs(bottom[i - 1] - top[i - 1] - bottom[i] + top[i])
+        close_mid = mid_gap < 2 * y_threshold
+        close_height = height_gap < y_threshold
+        if close_mid and close_height:
+            top[i] = top[i - 1]
+            bottom[i] = bottom[i - 1]
+    extents[:, 1] = top
+    extents[:, 3] = bottom
 
 
 @define
 class Page:
+    """
+    A page laid out in columns: `bboxes` holds one `[x_left, y_top, x_right,
+    y_bottom]` row per line in reading order, matching `texts`.
+    """
+
     page_number: int
-    lines: list[Line] = field(
-        converter=lambda x: [Line(box[1][0], box[0]) for box in x]
-    )
-    sorted_lines: list[Line] = field(init=False)
+    # Raw `[box, (text, score)]` OCR result
+    lines: list = field(repr=False)
+    texts: list[str] = field(init=False, repr=False)
+    bboxes: np.ndarray = field(init=False, repr=False)
     text: str = field(init=False)
 
     def __attrs_post_init__(self):
-        # Realign lines
-        self.sorted_lines = self.realign_lines(self.lines)
-        self.text = format_pdf_text(self.sorted_lines)
+        boxes = np.asarray([box for box, _ in self.lines], dtype=np.float64)
+        extents = line_extents(boxes.reshape(-1, 4, 2))
+        realign_rows(extents)
 
-    @staticmethod
-    def realign_lines(lines: list[Line]):
-        for i in range(len(lines)):
-            for j in range(0, len(lines) - i - 1):
-                current_line = lines[j]
-                next_line = lines[j + 1]
+        # Reading order: by y_top, then x_left (lexsort is stable, like sorted)
+        order = np.lexsort((extents[:, 0], extents[:, 1]))
+        self.bboxes = extents[order]
+        self.texts = [self.lines[i][1][0] for i in order.tolist()]
+        self.text = format_pdf_text(self.texts, self.bboxes)
 
-                if current_line.same_level(next_line):
-                    lines[j + 1].y_top = current_line.y_top
-                    lines[j + 1].y_bottom = current_line.y_bottom
+    @property
+    def formatted_lines(self) -> list[dict]:
+        return format_lines(self.texts, self.bboxes)
 
-                lines[i + 1].set_ouptut_bbox()
-        return sorted(lines, key=lambda x: (x.y_top, x.x_left))
+    @property
+    def formatted_result(self) -> dict:
+        return {
+            "page_number": self.page_number,
+            "lines": self.formatted_lines,
+            "text": self.text,
+        }
 
 
 @define
@@ -87,19 +111,27 @@ class Document:
     def formatted_results(self):
         return {
             "file_path": self.file_path,
-            "pages": [
-                {
-                    "page_number": page.page_number,
-                    "lines": [
-                        {"text": line.text, "bbox": line.output_bbox}
-                        for line in page.sorted_lines
-                    ],
-                    "text": page.text,
-                }
-                for page in self.pages
-            ],
+            "pages": [page.formatted_result for page in self.pages],
         }
 
+    @property
+    def summary(self) -> dict:
+        """What a job keeps of the document, its pages being stored as PageResults."""
+        return {"file_path": self.file_path, "page_count": len(self.pages)}
+
+
+def model_path(name: str, precision: str | None = None) -> Path:
+    """
+    Path of PaddleOCR model `name` ("det", "rec" or "cls") at `precision`, by default
+    OCR_MODEL_PRECISION. INT8 variants, made by scripts/quantize_models.py, sit next to
+    the FP32 models with an _int8 suffix; there is none of the small angle classifier.
+    """
+    path = settings.PADDLE_MODELS_DIR / settings.PADDLE_MODEL_FILES[name]
+    precision = precision or settings.OCR_MODEL_PRECISION
+    if precision == "int8" and name in QUANTIZED_MODELS:
+        return path.with_stem(f"{path.stem}_int8")
+    return path
+
 
 def read_file(pdf_path: str) -> pymupdf.Document:
     if pdf_path.startswith("http"):
@@ -110,52 +142,187 @@ def read_file(pdf_path: str) -> pymupdf.Document:
     return pymupdf.open(pdf_path)
 
 
-def format_pdf_text(lines: list[Line]) -> str:
-    # Group lines by their y-coordinate (within a threshold)
+def count_pages(path: str) -> int:
+    with read_file(path) as document:
+        return document.page_count
+
+
+def format_pdf_text(texts: list[str], bboxes: np.ndarray) -> str:
+    """Lay lines out as plain text, one row per group of lines at the same height."""
+    if not texts:
+        return ""
     threshold = 10
-    line_groups = {}
-
-    # Find leftmost x coordinate to use as reference point
-    min_x = min(line.x_left for line in lines)
-
-    for line in lines:
-        y = line.y_top
-        # Find the closest group
-        group_y = None
-        for existing_y in line_groups:
-            if abs(existing_y - y) < threshold:
-                group_y = existing_y
-                break
-        if group_y is None:
-            group_y = y
-        if group_y not in line_groups:
-            line_groups[group_y] = []
-        line_groups[group_y].append(line)
-
-    # Sort groups by y-coordinate
-    result = []
-    for y in sorted(line_groups.keys()):
-        # Sort lines within group by x-coordinate
-        lines_in_group = sorted(line_groups[y], key=lambda l: l.x_left)
-
-        # Build line with proper spacing
-        current_x = min_x
-        line_text = ""
-        for line in lines_in_group:
-            # Add spaces based on x position
-            spaces_needed = int(
-                (line.x_left - current_x) / 5
-            )  # Divide by 5 to scale down
-            line_text += " " * spaces_needed + line.text
-            current_x = line.x_right
-
-        result.append(line_text)
-
-    return "\n".join(result)
-
-
-def extract_zip(zip_file: UploadedFile, extract_path: str) -> list[str]:
-    extracted_files = []
-    with zipfile.ZipFile(zip_file) as zip_ref:
-        zip_ref.extractall(extract_path)
-        extracted_files = zip_ref.namelist()
+    x_left, y_top, x_right = bboxes[:, 0], bboxes[:, 1], bboxes[:, 2]
+
+    # Lines come sorted by y_top. A row starts at the first line at least
+    # `threshold` below the start of the previous row, so jump from row to row
+    row_starts = np.zeros(len(texts), dtype=bool)
+    i = 0
+    while i < len(texts):
+        row_starts[i] = True
+        i = np.searchsorted(y_top, y_top[i] + threshold)
+    rows = np.cumsum(row_starts)
+
+    # Within a row, order by x and pad each line by its gap to the previous line,
+    # or to the leftmost line on the page for the first one
+    order = np.lexsort((x_left, rows))
+    firsts = np.diff(rows[order], prepend=0) > 0
+    previous_x = np.roll(x_right[order], 1)
+    previous_x[firsts] = x_left.min()
+    # Divide by 5 to scale down
+    spaces = np.trunc((x_left[order] - previous_x) / 5).astype(np.int64).clip(min=0)
+
+    chunks = [" " * s + texts[j] for s, j in zip(spaces.tolist(), order.tolist())]
+    bounds = [*np.flatnonzero(firsts).tolist(), len(chunks)]
+    return "\n".join("".join(chunks[a:b]) for a, b in pairwise(bounds))
+
+
+def format_lines(texts: list[str], bboxes: np.ndarray) -> list[dict]:
+    """Lines as API results, each extent turned back into a four-corner box."""
+    return [
+        {
+            "text": text,
+            "bbox": [
+                (x_left, y_top),
+                (x_right, y_top),
+                (x_right, y_bottom),
+                (x_left, y_bottom),
+            ],
+        }
+        for text, (x_left, y_top, x_right, y_bottom) in zip(texts, bboxes.tolist())
+    ]
+
+
+def parse_lines(lines: list[dict]) -> tuple[list[str], np.ndarray]:
+    """Texts and extents back from lines formatted by format_lines."""
+    texts = [line["text"] for line in lines]
+    corners = [(*line["bbox"][0], *line["bbox"][2]) for line in lines]
+    return texts, np.asarray(corners, dtype=np.int64).reshape(-1, 4)
+
+
+def pack_lines(texts: list[str], bboxes: np.ndarray) -> tuple[bytes, bytes]:
+    """
+    Compact storage for a page's lines: texts as compressed JSON, extents as raw
+    little-endian int32s. The page text is left out, as format_pdf_text rebuilds it.
+    """
+    texts_json = json.dumps(texts, ensure_ascii=False, separators=(",", ":"))
+    return compress(texts_json.encode()), np.asarray(bboxes, "<i4").tobytes()
+
+
+def unpack_lines(texts: bytes, bboxes: bytes) -> tuple[list[str], np.ndarray]:
+    extents = np.frombuffer(bboxes, "<i4").reshape(-1, 4).astype(np.int64)
+    return json.loads(decompress(texts)), extents
+
+
+def compress(data: bytes) -> bytes:
+    """`data` compressed for storage by OCR_STORE_COMPRESSION, "zlib" or "zstd"."""
+    if settings.OCR_STORE_COMPRESSION == "zstd":
+        return zstandard.ZstdCompressor().compress(data)
+    return zlib.compress(data)
+
+
+def decompress(data: bytes) -> bytes:
+    """Stored `data` decompressed by whichever codec compressed it."""
+    if bytes(data[: len(ZSTD_MAGIC)]) == ZSTD_MAGIC:
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def format_page(page_number: int, texts: list[str], bboxes: np.ndarray) -> dict:
+    """A page as an API result, as Page.formatted_result formats it."""
+    return {
+        "page_number": page_number,
+        "lines": format_lines(texts, bboxes),
+        "text": format_pdf_text(texts, bboxes),
+    }
+
+
+def format_columns(page_number: int, texts: list[str], bboxes: np.ndarray) -> dict:
+    """
+    A page as a columnar API result: its line texts, and their extents as one flat
+    array of x_left, y_top, x_right, y_bottom for each line in turn. Boxes are
+    axis-aligned, so this is all of a four-corner box in half the numbers.
+    """
+    return {
+        "page_number": page_number,
+        "texts": texts,
+        "bboxes": bboxes.ravel().tolist(),
+        "text": format_pdf_text(texts, bboxes),
+    }
+
+
+class UnsafeZipError(ValueError):
+    """A zip archive that breaks the extraction limits, e.g. a zip bomb."""
+
+
+class BoundedReader:
+    """
+    Reader over a zip member that raises UnsafeZipError once more than `limit` bytes
+    have been decompressed, whatever sizes the archive headers declare.
+    """
+
+    def __init__(self, member: IO[bytes], name: str, limit: int):
+        self.member = member
+        self.name = name
+        self.limit = limit
+        self.bytes_read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        # Never decompress more than one byte past the limit
+        budget = self.limit + 1 - self.bytes_read
+        data = self.member.read(budget if size < 0 else min(size, budget))
+        self.bytes_read += len(data)
+        if self.bytes_read > self.limit:
+            raise UnsafeZipError(f"{self.name} decompresses to over {self.limit} bytes")
+        return data
+
+
+def iter_zip_members(zip_file: IO[bytes]) -> Iterator[tuple[str, BoundedReader]]:
+    """
+    Stream the files in a zip archive as `(name, reader)` pairs, decompressing each
+    member as it is read so memory stays bounded whatever the archive size. Consume
+    each reader before asking for the next member.
+
+    Names are flattened to unique base names. The OCR_ZIP_* limits on member count,
+    member size, total size and compression ratio are checked against the headers up
+    front, and enforced on the bytes actually decompressed.
+    """
+    with zipfile.ZipFile(zip_file) as archive:
+        members = [info for info in archive.infolist() if not info.is_dir()]
+        if len(members) > settings.OCR_ZIP_MAX_MEMBERS:
+            raise UnsafeZipError(f"Archive has {len(members)} files")
+        if sum(info.file_size for info in members) > settings.OCR_ZIP_MAX_TOTAL_BYTES:
+            raise UnsafeZipError("Archive is too large once extracted")
+
+        names = set()
+        total = 0
+        for info in members:
+            name = Path(info.filename).name
+            stem, suffix = Path(name).stem, Path(name).suffix
+            for n in count(1):
+                if name not in names:
+                    break
+                name = f"{stem}_{n}{suffix}"
+            names.add(name)
+
+            limit = min(
+                settings.OCR_ZIP_MAX_MEMBER_BYTES,
+                settings.OCR_ZIP_MAX_TOTAL_BYTES - total,
+                max(info.compress_size, 1) * settings.OCR_ZIP_MAX_RATIO,
+            )
+            if info.file_size > limit:
+                raise UnsafeZipError(f"{info.filename} is too large once extracted")
+
+            with archive.open(info) as member:
+                reader = BoundedReader(member, info.filename, limit)
+                yield name, reader
+                total += reader.bytes_read
+
+
+def extract_zip(zip_file: IO[bytes], extract_path: str) -> Iterator[Path]:
+    """Extract the files in a zip archive, yielding each path once it is written."""
+    for name, member in iter_zip_members(zip_file):
+        path = Path(extract_path) / name
+        with path.open("wb") as dest:
+            shutil.copyfileobj(member, dest, ZIP_CHUNK_SIZE)
+        yield path
@@ -1,80 +1,188 @@
 import asyncio
 import logging
+import shutil
+from collections import Counter
+from functools import partial
 from pathlib import Path
-from tempfile import TemporaryDirectory
+from tempfile import mkdtemp
+from typing import Iterable
 
 from adrf.decorators import api_view
 from asgiref.sync import sync_to_async
-from django.apps import apps
 from django.conf import settings
 from django.core.files.uploadedfile import UploadedFile
+from django.http import StreamingHttpResponse
 from rest_framework import status
+from rest_framework.decorators import renderer_classes
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.request import Request
 from rest_framework.response import Response
 
-from .inference import OcrEngine
+from .cache import digest_path, digest_upload, page_cache, result_cache
+from .events import job_events, job_state
+from .middleware import compress_response
 from .models import Job
+from .progress import (
+    add_pages_total,
+    full_result,
+    iter_job_pages,
+    job_pages,
+    page_recorder,
+    store_documents,
+)
+from .renderers import (
+    ColumnarJSONRenderer,
+    EventStreamRenderer,
+    MessagePackRenderer,
+    NDJSONRenderer,
+    ORJSONRenderer,
+    job_result_json,
+    ndjson_lines,
+)
+from .scheduler import SchedulerFull, job_scheduler
 from .serializers import (
     DocumentSerializer,
     JobSerializer,
     MultipartSerializer,
+    PagesQuerySerializer,
     PathSerializer,
 )
-from .utils import extract_zip
+from .states import transition
+from .utils import UnsafeZipError, count_pages, extract_zip
+from .worker import worker_engine
 
 logger = logging.getLogger(settings.APP_NAME)
 
 
-async def process_path(
-    job_id, input_path: Path, multi_files: bool, ocr_engine: OcrEngine
+def process_path(
+    job_id,
+    input_path: Path,
+    multi_files: bool,
+    files: Iterable[Path] | None = None,
 ):
-    job = await sync_to_async(Job.objects.get)(id=job_id)
-
-    # Update status to processing
-    job.status = "processing"
-    await sync_to_async(job.save)()
+    """
+    OCR the file or directory at `input_path`, in a job_scheduler worker process. For
+    a directory, `files` can yield its files as they are written, and each is OCRed as
+    soon as it arrives.
+    """
+    ocr_engine = worker_engine()
+    job = Job.objects.get(id=job_id)
+    transition(job, "processing")
 
     documents = []
+    page_stats = Counter()
     if input_path.is_dir():
+        files = input_path.glob("*") if files is None else files
         if multi_files:
-            ocr_result = await sync_to_async(ocr_engine.ocr_document_multi)(
-                input_path.as_posix()
+            # One document over all files, so wait until every file is there
+            pages_total = sum(count_pages(f.as_posix()) for f in files)
+            add_pages_total(job_id, pages_total)
+            ocr_result = ocr_engine.ocr_document_multi(
+                input_path.as_posix(), stats=page_stats, on_pages=page_recorder(job_id)
             )
-            documents.append(ocr_result.formatted_results)
+            documents.append(ocr_result.summary)
         else:
-            for f in input_path.glob("*"):
-                ocr_result = await sync_to_async(ocr_engine.ocr_document)(f.as_posix())
-                documents.append(ocr_result.formatted_results)
+            # Files may still be arriving, so the total grows as each one starts
+            for i, f in enumerate(files):
+                add_pages_total(job_id, count_pages(f.as_posix()))
+                ocr_result = ocr_engine.ocr_document(
+                    f.as_posix(), stats=page_stats, on_pages=page_recorder(job_id, i)
+                )
+                documents.append(ocr_result.summary)
 
     else:
-        ocr_result = await sync_to_async(ocr_engine.ocr_document)(input_path.as_posix())
-        documents.append(ocr_result.formatted_results)
+        add_pages_total(job_id, count_pages(input_path.as_posix()))
+        ocr_result = ocr_engine.ocr_document(
+            input_path.as_posix(), stats=page_stats, on_pages=page_recorder(job_id)
+        )
+        documents.append(ocr_result.summary)
 
-    # Update with result
-    job.status = "completed"
-    job.result = {
+    page_summary = page_cache.summary(page_stats)
+    logger.info(f"{job_id=} | {page_summary=}")
+
+    result = {
         "documents": documents,
         "message": "Processing completed successfully",
+        "page_stats": page_summary,
     }
-    await sync_to_async(job.save)()
-
+    transition(job, "completed", result=result)
 
-async def process_file(
-    job_id, uploaded_file: UploadedFile, multi_files: bool, ocr_engine: OcrEngine
-):
-    with TemporaryDirectory() as tmp_dir:
-        # Read file and unzip into temporary directory
-        if uploaded_file.name.lower().endswith(".zip"):
-            extract_zip(uploaded_file, tmp_dir)
-            input_path = Path(tmp_dir)
 
+def process_file(job_id, file_path: Path, multi_files: bool):
+    """
+    OCR an upload saved by save_upload, in a job_scheduler worker process, then
+    remove it.
+    """
+    try:
+        if file_path.name.lower().endswith(".zip"):
+            # Members are extracted one at a time as process_path asks for them
+            input_path = file_path.parent / "files"
+            input_path.mkdir()
+            with file_path.open("rb") as zip_file:
+                files = extract_zip(zip_file, input_path)
+                process_path(job_id, input_path, multi_files, files)
         else:
-            input_path = Path(tmp_dir) / uploaded_file.name
-            with input_path.open("wb") as dest:
-                for chunk in uploaded_file.chunks():
-                    dest.write(chunk)
+            process_path(job_id, file_path, multi_files)
+
+    except UnsafeZipError as e:
+        logger.error(f"Rejected zip upload for {job_id=}: {e}")
+        transition(job_id, "failed", result={"message": f"Invalid zip archive: {e}"})
+    finally:
+        shutil.rmtree(file_path.parent)
+
+
+def save_upload(uploaded_file: UploadedFile) -> Path:
+    """
+    Copy an upload to a temporary directory of its own, since the request's copy is
+    gone by the time a worker gets to it.
+    """
+    file_path = Path(mkdtemp()) / uploaded_file.name
+    with file_path.open("wb") as dest:
+        for chunk in uploaded_file.chunks():
+            dest.write(chunk)
+    return file_path
+
+
+def queue_full(retry_after: int) -> Response:
+    return Response(
+        {"message": "Too many jobs queued, try again later"},
+        status=status.HTTP_429_TOO_MANY_REQUESTS,
+        headers={"Retry-After": str(retry_after)},
+    )
+
+
+def cache_result(job_id: str, cache_key: str):
+    """
+    Cache the result of a job its worker completed. Called in the web process, whose
+    result cache complete_from_cache reads, as workers each have their own.
+    """
+    job = Job.objects.get(id=job_id)
+    if job.status == "completed":
+        result_cache.set(cache_key, full_result(job))
+
+
+async def complete_from_cache(job: Job, cache_key: str) -> bool:
+    """Complete `job` straight away if the same input was OCRed before."""
+    cached = await sync_to_async(result_cache.get)(cache_key)
+    if cached is None:
+        return False
+
+    logger.info(f"Result cache hit for {job.id=}")
+    documents = await sync_to_async(store_documents)(job.id, cached["documents"])
+    pages = sum(document["page_count"] for document in documents)
+    return await sync_to_async(transition)(
+        job,
+        "completed",
+        result={**cached, "documents": documents},
+        pages_total=pages,
+        pages_done=pages,
+    )
+
 
-    await process_path(job_id, input_path, multi_files, ocr_engine)
+async def serialize_job(job: Job, pages: bool = True, columnar: bool = False) -> dict:
+    # Completed jobs are serialized with their pages, read from the database
+    context = {"pages": pages, "columnar": columnar}
+    return await sync_to_async(lambda: JobSerializer(job, context=context).data)()
 
 
 # Create your views here.
@@ -92,21 +200,23 @@ async def ocr_job(request: Request):
 
     logger.info(f"ocr_job POST request received with data: {request.data}")
 
-    ocr_engine = apps.get_app_config(settings.APP_NAME).ocr_engine
-    logger.info(
-        f"Got OCR engine at {asyncio.get_event_loop().time() - start_time:.2f}s"
+    # Turn jobs away before reading their input, submitting checks again
+    try:
+        job_scheduler.check()
+    except SchedulerFull as e:
+        return queue_full(e.retry_after)
+
+    job = await sync_to_async(Job.objects.create)(
+        result={"message": "Processing started"}
     )
-    job = await sync_to_async(Job.objects.create)()
-    job.result = {"message": "Processing started"}
-    await sync_to_async(job.save)()
     logger.info(f"Created job at {asyncio.get_event_loop().time() - start_time:.2f}s")
 
     if "path" in request.data:
         request_serializer = PathSerializer(data=request.data)
         if not request_serializer.is_valid():
-            job.result = request_serializer.error_messages
-            job.status = "failed"
-            await sync_to_async(job.save)()
+            await sync_to_async(transition)(
+                job, "failed", result=request_serializer.error_messages
+            )
 
             return Response(
                 request_serializer.error_messages, status=status.HTTP_400_BAD_REQUEST
@@ -120,54 +230,201 @@ async def ocr_job(request: Request):
         logger.info(
             f"Validated path at {asyncio.get_event_loop().time() - start_time:.2f}s"
         )
-        # Start processing in the background
-        asyncio.create_task(
-            process_path(job.id, input_path, multiple_files, ocr_engine)
-        )
+
+        on_success = None
+        if input_path.exists():
+            digest = await sync_to_async(digest_path)(input_path)
+            cache_key = result_cache.key(digest, multi_files=multiple_files)
+            if await complete_from_cache(job, cache_key):
+                return Response(
+                    await serialize_job(job), status=status.HTTP_201_CREATED
+                )
+            on_success = partial(cache_result, job.id, cache_key)
+
+        # Queue for processing in the background
+        try:
+            job_scheduler.submit(
+                job.id,
+                process_path,
+                job.id,
+                input_path,
+                multiple_files,
+                on_success=on_success,
+            )
+        except SchedulerFull as e:
+            await sync_to_async(job.delete)()
+            return queue_full(e.retry_after)
         logger.info(
-            f"Created background task at {asyncio.get_event_loop().time() - start_time:.2f}s"
+            f"Queued job at {asyncio.get_event_loop().time() - start_time:.2f}s"
         )
 
         # Return the job ID immediately
-        response_serializer = JobSerializer(job)
+        data = await serialize_job(job)
         logger.info(
             f"Prepared response at {asyncio.get_event_loop().time() - start_time:.2f}s"
         )
-        return Response(response_serializer.data, status=status.HTTP_201_CREATED)
+        return Response(data, status=status.HTTP_201_CREATED)
 
     request_serializer = MultipartSerializer(data=request.data)
     if not request_serializer.is_valid():
-        job.result = request_serializer.error_messages
-        job.status = "failed"
-        await sync_to_async(job.save)()
+        await sync_to_async(transition)(
+            job, "failed", result=request_serializer.error_messages
+        )
         return Response(
             request_serializer.error_messages, status=status.HTTP_400_BAD_REQUEST
         )
 
     uploaded_file = request_serializer.validated_data["file"]
 
-    # Start processing in the background
-    asyncio.create_task(process_file(job.id, uploaded_file, False, ocr_engine))
+    digest = await sync_to_async(digest_upload)(uploaded_file)
+    cache_key = result_cache.key(digest, multi_files=False)
+    if await complete_from_cache(job, cache_key):
+        return Response(await serialize_job(job), status=status.HTTP_201_CREATED)
 
-    # Return the job ID immediately
-    response_serializer = JobSerializer(job)
+    # Queue for processing in the background
+    file_path = await sync_to_async(save_upload)(uploaded_file)
+    try:
+        job_scheduler.submit(
+            job.id,
+            process_file,
+            job.id,
+            file_path,
+            False,
+            on_success=partial(cache_result, job.id, cache_key),
+        )
+    except SchedulerFull as e:
+        shutil.rmtree(file_path.parent)
+        await sync_to_async(job.delete)()
+        return queue_full(e.retry_after)
 
-    return Response(response_serializer.data, status=status.HTTP_201_CREATED)
+    # Return the job ID immediately
+    return Response(await serialize_job(job), status=status.HTTP_201_CREATED)
 
 
+@compress_response
 @api_view(["GET"])
+@renderer_classes(
+    [ORJSONRenderer, BrowsableAPIRenderer, ColumnarJSONRenderer, MessagePackRenderer]
+)
 async def ocr_result(request: Request, job_id):
+    """
+    A job and, once it is completed, its result. Completed jobs asked for as JSON
+    are written straight from their stored pages a chunk at a time, without building
+    the whole result first. Clients asking for application/vnd.ocr.columnar+json or
+    application/msgpack (or ?format=columnar or msgpack) get the lines of each page
+    column-wise, in a fraction of the size.
+    """
     logger.info(f"ocr_result GET request received with {job_id=}")
 
     try:
         job = await sync_to_async(Job.objects.get)(id=job_id)
-        serializer = JobSerializer(job)
-        return Response(serializer.data)
     except Job.DoesNotExist:
         return Response({"message": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
 
+    columnar = getattr(request.accepted_renderer, "columnar", False)
+    if job.status == "completed" and isinstance(
+        request.accepted_renderer, ORJSONRenderer
+    ):
+        data = await serialize_job(job, pages=False)
+        chunks = job_result_json(data, iter_job_pages(job, columnar=columnar))
+        return StreamingHttpResponse(
+            chunks, content_type=request.accepted_renderer.media_type
+        )
+
+    return Response(await serialize_job(job, columnar=columnar))
+
+
+@compress_response
+@api_view(["GET"])
+@renderer_classes(
+    [
+        ORJSONRenderer,
+        BrowsableAPIRenderer,
+        NDJSONRenderer,
+        ColumnarJSONRenderer,
+        MessagePackRenderer,
+    ]
+)
+async def ocr_result_pages(request: Request, job_id):
+    """
+    Pages of a job done so far, so clients can start on early pages while the rest
+    are OCRed. Returns `limit` pages from `offset` as JSON, or streams every page
+    from `offset` on as NDJSON when asked for application/x-ndjson (or
+    ?format=ndjson). Pages come column-wise in the compact formats ocr_result offers.
+    """
+    logger.info(f"ocr_result_pages GET request received with {job_id=}")
+
+    query_serializer = PagesQuerySerializer(data=request.query_params)
+    if not query_serializer.is_valid():
+        return Response(query_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    offset = query_serializer.validated_data["offset"]
+    limit = query_serializer.validated_data["limit"]
+
+    try:
+        job = await sync_to_async(Job.objects.get)(id=job_id)
+    except Job.DoesNotExist:
+        return Response({"message": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    if request.accepted_renderer.format == NDJSONRenderer.format:
+
+        async def lines():
+            async for pages in iter_job_pages(job, offset):
+                for line in ndjson_lines(pages):
+                    yield line
+
+        response = StreamingHttpResponse(
+            lines(), content_type=NDJSONRenderer.media_type
+        )
+        response["X-Job-Status"] = job.status
+        response["X-Pages-Done"] = job.pages_done
+        response["X-Pages-Total"] = job.pages_total
+        return response
+
+    columnar = getattr(request.accepted_renderer, "columnar", False)
+    pages = await sync_to_async(job_pages)(job, offset, limit, columnar)
+    return Response(
+        {
+            "id": job.id,
+            "status": job.status,
+            "pages_done": job.pages_done,
+            "pages_total": job.pages_total,
+            "next_offset": offset + len(pages),
+            "pages": pages,
+        }
+    )
+
+
+@api_view(["GET"])
+@renderer_classes([EventStreamRenderer, ORJSONRenderer])
+async def ocr_result_events(request: Request, job_id):
+    """
+    Server-sent events with a job's status and progress as they change, so clients
+    can wait for the result instead of polling ocr_result.
+    """
+    logger.info(f"ocr_result_events GET request received with {job_id=}")
+
+    state = await sync_to_async(job_state)(job_id)
+    if state is None:
+        return Response({"message": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    response = StreamingHttpResponse(
+        job_events(job_id, state), content_type=EventStreamRenderer.media_type
+    )
+    response["Cache-Control"] = "no-cache"
+    # Stop nginx from buffering events
+    response["X-Accel-Buffering"] = "no"
+    return response
+
 
 @api_view(["GET"])
 async def health_check(request):
     logger.info("Health check request")
-    return Response({"status": "healthy"}, status=status.HTTP_200_OK)
+    cache_stats = await sync_to_async(result_cache.stats)()
+    return Response(
+        {
+            "status": "healthy",
+            "result_cache": cache_stats,
+            "scheduler": job_scheduler.stats(),
+        },
+        status=status.HTTP_200_OK,
+    )
@@ -0,0 +1,39 @@
+"""
+Setup of JobScheduler worker processes. They import this module before Django is set
+up, so it must not import models at the top level.
+"""
+
+import multiprocessing
+from multiprocessing.sharedctypes import Synchronized
+
+import django
+from django.conf import settings
+
+from .inference import OcrEngine, pin_worker
+
+# The engine of this worker process, loaded once when the process starts
+_engine: OcrEngine | None = None
+
+
+def init_worker(notifications: multiprocessing.SimpleQueue, slots: Synchronized):
+    global _engine
+    django.setup()
+    from . import events
+
+    # Clients wait on the notifier of the web process, so hand job states back to it
+    events.job_notifier = events.RelayNotifier(notifications)
+    # Each worker takes the next slot, for its own cores when pinning
+    with slots.get_lock():
+        slot = slots.value
+        slots.value += 1
+    pin_worker(slot)
+    _engine = OcrEngine()
+    if settings.OCR_WARM_UP:
+        _engine.warm_up()
+
+
+def worker_engine() -> OcrEngine:
+    """The OcrEngine of the current worker process, for jobs run by JobScheduler."""
+    if _engine is None:
+        raise RuntimeError("Not running in a JobScheduler worker process")
+    return _engine
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ocr_api.settings')
 
 application = get_asgi_application()
+
+from ocr.scheduler import job_scheduler  # noqa: E402
+
+# Load the OCR engines of the job workers before the first request
+job_scheduler.start()
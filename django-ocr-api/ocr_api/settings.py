@@ -75,6 +75,10 @@ INSTALLED_APPS = [
 REST_FRAMEWORK = {
     # YOUR SETTINGS
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
+    "DEFAULT_RENDERER_CLASSES": [
+        "ocr.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
 }
 
 MIDDLEWARE = [
@@ -119,6 +123,101 @@ DATABASES = {
 }
 
 PADDLE_MODELS_DIR = BASE_DIR.parent / "models" / "paddle_onnx"
+PADDLE_MODEL_FILES = {
+    "cls": "ch_ppocr_mobile_v2.0_cls_infer.onnx",
+    "det": "Multilingual_PP-OCRv3_det_infer.onnx",
+    "rec": "latin_PP-OCRv3_rec_infer.onnx",
+}
+
+# Model precision, "fp32" or "int8" for the quantized detection and recognition models
+# made by the Celery app's scripts/quantize_models.py (with --models-dir pointing here).
+# Check their accuracy on your documents with its scripts/compare_precision.py first
+OCR_MODEL_PRECISION = "fp32"
+
+# Pages per batched detection/recognition run, and text crops per recognizer call
+OCR_BATCH_SIZE = 4
+OCR_REC_BATCH_SIZE = 32
+# Rendered pages kept queued ahead of inference; bounds memory per running job
+OCR_PREFETCH_DEPTH = 8
+# ONNX Runtime sessions: threads within and across operators (0 lets ONNX Runtime pick,
+# one per core), execution mode, graph optimization level, and whether idle threads
+# spin. With several workers on a machine, keep workers x intra-op threads at about the
+# core count, or they oversubscribe the CPU. The Celery app's scripts/bench_threads.py
+# finds the best mix
+OCR_ORT_INTRA_OP_THREADS = 0
+OCR_ORT_INTER_OP_THREADS = 0
+OCR_ORT_EXECUTION_MODE = "ORT_SEQUENTIAL"
+OCR_ORT_GRAPH_OPTIMIZATION = "ORT_ENABLE_ALL"
+OCR_ORT_ALLOW_SPINNING = True
+# Pin each worker process to its own OCR_ORT_INTRA_OP_THREADS cores (Linux only)
+OCR_PIN_WORKERS = False
+# Run a first inference on a synthetic image when a worker loads its OcrEngine, so
+# the first job does not pay for it
+OCR_WARM_UP = True
+# Render resolution: target DPI, floor for low-resolution scans, and a pixel budget
+# per page that caps large formats
+OCR_RENDER_DPI = 144
+OCR_RENDER_MIN_DPI = 72
+OCR_RENDER_MAX_PIXELS = 4_000_000
+# Use the native text layer of born-digital PDF pages when it has at least this many
+# characters, and only OCR scanned or image-only pages. Scans whose text layer covers
+# less than this fraction of the scanned image, such as a stamp or header, are OCRed
+OCR_USE_TEXT_LAYER = True
+OCR_TEXT_LAYER_MIN_CHARS = 20
+OCR_TEXT_LAYER_MIN_COVERAGE = 0.03
+
+# Pages per response from the pages endpoint, by default and at most
+OCR_PAGES_LIMIT = 50
+OCR_PAGES_MAX_LIMIT = 500
+
+# Result responses are compressed with zstd or gzip, whichever the client accepts by
+# Accept-Encoding, at these levels
+OCR_RESPONSE_COMPRESSION_LEVELS = {"zstd": 3, "gzip": 6}
+
+# Codec for stored results, the line texts in the page store and entries in the result
+# cache: "zlib", or "zstd", which is faster at a similar ratio. Stored results are read
+# whichever codec wrote them, so this can be changed at any time
+OCR_STORE_COMPRESSION = "zlib"
+
+# OCR jobs run on a pool of OCR_WORKERS processes, each loading its own OcrEngine. Up
+# to OCR_QUEUE_SIZE more jobs wait for a free worker, and jobs beyond that are turned
+# away with 429 Too Many Requests, asking clients to retry after OCR_RETRY_AFTER seconds
+OCR_WORKERS = 2
+OCR_QUEUE_SIZE = 20
+OCR_RETRY_AFTER = 30
+
+# Job event streams: seconds between keep-alives, and before a stream is closed for
+# the client to reconnect
+OCR_EVENTS_HEARTBEAT = 15
+OCR_EVENTS_TIMEOUT = 60 * 5
+
+# Limits on uploaded zip archives, against zip bombs
+OCR_ZIP_MAX_MEMBERS = 1000
+OCR_ZIP_MAX_MEMBER_BYTES = 1024 * 1024 * 200  # 200 MB
+OCR_ZIP_MAX_TOTAL_BYTES = 1024 * 1024 * 1024 * 2  # 2 GB
+OCR_ZIP_MAX_RATIO = 100
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "OPTIONS": {"MAX_ENTRIES": 500},
+    }
+}
+
+# Content-addressed cache of finished OCR results
+OCR_RESULT_CACHE = "default"
+OCR_RESULT_CACHE_TIMEOUT = 60 * 60 * 24 * 7  # 1 week
+OCR_RESULT_CACHE_MAX_BYTES = 1024 * 1024 * 20  # 20 MB
+
+# Per-page cache of raw OCR output keyed by rendered pixels, for pages that recur across
+# documents
+OCR_USE_PAGE_CACHE = True
+OCR_PAGE_CACHE = "default"
+OCR_PAGE_CACHE_TIMEOUT = 60 * 60 * 24 * 7  # 1 week
+
+# Alias used when the caches above are unreachable, and seconds before retrying them
+OCR_CACHE_FALLBACK = "default"
+OCR_CACHE_RETRY_AFTER = 30
 
 
 SPECTACULAR_SETTINGS = {
@@ -0,0 +1,140 @@
+"""
+Load test database queries of clients polling for job progress against streaming it.
+
+Polling asks GET /ocr/<job_id>/ over and over, streaming waits on the events from
+GET /ocr/<job_id>/events/. Simulates --jobs jobs of --pages pages, OCRed at --page-time
+seconds a page, each watched by --clients clients, with pollers asking again every
+--poll-interval seconds. Queries the jobs make themselves are measured separately and
+left out.
+
+    python scripts/load_test_events.py
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import django
+from asgiref.sync import sync_to_async
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ocr_api.settings")
+
+
+class QueryCounter:
+    """Database execute wrapper counting queries."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+
+def setup(db_path: Path) -> QueryCounter:
+    from django.conf import settings
+
+    settings.DATABASES["default"]["NAME"] = db_path
+    django.setup()
+    logging.getLogger(settings.APP_NAME).setLevel(logging.WARNING)
+
+    from django.core.management import call_command
+    from django.db import connection
+
+    call_command("migrate", verbosity=0)
+    counter = QueryCounter()
+
+    # Views run their queries through sync_to_async, all on one thread
+    def install():
+        connection.execute_wrappers.append(counter)
+
+    asyncio.run(sync_to_async(install)())
+    return counter
+
+
+async def run_job(job_id: str, pages: int, page_time: float):
+    from ocr.events import notify_job
+    from ocr.models import Job
+    from ocr.progress import add_pages_total, page_recorder
+    from ocr.utils import Page
+
+    await sync_to_async(Job.objects.filter(id=job_id).update)(status="processing")
+    await sync_to_async(add_pages_total)(job_id, pages)
+    record = page_recorder(job_id)
+    for page_number in range(pages):
+        await asyncio.sleep(page_time)
+        await sync_to_async(record)([Page(page_number, [])])
+
+    result = {"documents": [], "message": "Processing completed successfully"}
+    await sync_to_async(Job.objects.filter(id=job_id).update)(
+        status="completed", result=result
+    )
+    await sync_to_async(notify_job)(job_id)
+
+
+async def poll(client, job_id: str, interval: float):
+    while (await client.get(f"/ocr/{job_id}/")).json()["status"] != "completed":
+        await asyncio.sleep(interval)
+
+
+async def watch(client, job_id: str, interval: float):
+    response = await client.get(f"/ocr/{job_id}/events/")
+    async for _ in response.streaming_content:
+        pass
+
+
+async def run(watcher, counter: QueryCounter, args) -> tuple[int, float]:
+    """Queries made by `watcher` clients over a full set of jobs, and wall time."""
+    from django.test import AsyncClient
+    from ocr.models import Job
+
+    # Job IDs are millisecond timestamps, which collide when created in a loop
+    create = sync_to_async(Job.objects.create)
+    jobs = [await create(id=f"load_test_{uuid.uuid4().hex}") for _ in range(args.jobs)]
+    client = AsyncClient()
+    start_count, start = counter.count, time.perf_counter()
+    tasks = [run_job(job.id, args.pages, args.page_time) for job in jobs]
+    if watcher is not None:
+        tasks += [
+            watcher(client, job.id, args.poll_interval)
+            for job in jobs
+            for _ in range(args.clients)
+        ]
+    await asyncio.gather(*tasks)
+    return counter.count - start_count, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--jobs", type=int, default=10)
+    parser.add_argument("--clients", type=int, default=5)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--page-time", type=float, default=0.25)
+    parser.add_argument("--poll-interval", type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        counter = setup(Path(tmp_dir) / "load_test.sqlite3")
+        job_queries, _ = asyncio.run(run(None, counter, args))
+
+        clients = args.jobs * args.clients
+        print(f"{args.jobs} jobs x {args.pages} pages, {clients} clients")
+        print(f"{'mode':>8} {'queries':>8} {'per client':>11} {'wall':>7}")
+        for mode, watcher in (("polling", poll), ("events", watch)):
+            queries, wall = asyncio.run(run(watcher, counter, args))
+            queries -= job_queries
+            print(f"{mode:>8} {queries:>8} {queries / clients:>11.1f} {wall:>6.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Measure the startup time and memory of JobScheduler worker processes.
+
+Starts --workers workers with each multiprocessing start method given, the way
+JobScheduler does, and reports how long they took to load and warm up their engines
+and their memory from /proc (so Linux only): RSS, PSS, which splits shared pages
+between the processes sharing them, and USS, the pages private to each worker.
+
+    python scripts/measure_workers.py
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ocr_api.settings")
+
+from ocr.worker import init_worker  # noqa: E402
+
+
+def worker_memory(hold: float) -> dict:
+    """Memory of the calling process in MB, held for `hold` seconds."""
+    # Keep this worker busy so every worker gets one of the calls
+    time.sleep(hold)
+    kb = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if value.strip().endswith("kB"):
+                kb[name] = int(value.split()[0])
+    return {
+        "pid": os.getpid(),
+        "rss": kb["Rss"] / 1024,
+        "pss": kb["Pss"] / 1024,
+        "uss": (kb["Private_Clean"] + kb["Private_Dirty"]) / 1024,
+    }
+
+
+def measure(start_method: str, workers: int, hold: float) -> tuple[float, list[dict]]:
+    """Seconds until `workers` workers were ready, and the memory of each."""
+    context = multiprocessing.get_context(start_method)
+    if start_method == "forkserver":
+        context.set_forkserver_preload(["ocr.worker"])
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(
+        workers,
+        mp_context=context,
+        initializer=init_worker,
+        initargs=(context.SimpleQueue(), context.Value("i", 0)),
+    ) as pool:
+        futures = [pool.submit(worker_memory, hold) for _ in range(workers)]
+        memory = {m["pid"]: m for m in (f.result() for f in futures)}
+    return time.perf_counter() - start - hold, list(memory.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--start-methods", nargs="+", default=["spawn", "forkserver"])
+    parser.add_argument("--hold", type=float, default=2.0)
+    args = parser.parse_args()
+
+    print(
+        f"{'method':>10} {'workers':>8} {'ready':>7} {'rss':>9} {'pss':>9} {'uss':>9}"
+        "  (MB per worker)"
+    )
+    for start_method in args.start_methods:
+        ready, memory = measure(start_method, args.workers, args.hold)
+        rss, pss, uss = (
+            sum(m[key] for m in memory) / len(memory) for key in ("rss", "pss", "uss")
+        )
+        print(
+            f"{start_method:>10} {len(memory):>8} {ready:>6.1f}s"
+            f" {rss:>9.1f} {pss:>9.1f} {uss:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()